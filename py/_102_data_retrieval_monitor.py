@@ -433,5 +433,5 @@ if module_path not in sys.path:
 from modules import tools
 
 root_packages = [
-    'python', 'geopandas', 'pandas', 'matplotlib', 'owslib', 'requests', 'rasterio', 'lxml' 'dotenv']
+    'python', 'geopandas', 'pandas', 'matplotlib', 'owslib', 'requests', 'rasterio', 'lxml', 'dotenv']
 tools.package_report(root_packages)
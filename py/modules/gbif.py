@@ -0,0 +1,669 @@
+"""
+gbif.py – Harvesting of GBIF occurrence records from the
+occurrence search API (https://techdocs.gbif.org/en/openapi/v1/occurrence).
+
+Result pages are fetched concurrently over a shared keep-alive session,
+under a rate limit and with retry/backoff on 429 (Too Many Requests)
+and 5xx answers. Page frames are collected and concatenated once, or
+written to a folder of Parquet files (a Parquet dataset).
+
+Queries beyond the 100,000 offset limit of the search API are
+split into quadtree tiles of the query geometry (harvest_tiles).
+Harvested occurrences are kept in a partitioned Parquet store
+(OccurrenceStore) that is refreshed with only new or changed records.
+Records are converted to frames with a fixed schema of dtypes
+(OCCURRENCE_SCHEMA) directly from the json pages.
+
+Author: Dr.-Ing. Alexander Dunkel
+License: MIT License
+"""
+
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import pandas as pd
+import requests
+from shapely import wkt as shapely_wkt
+from shapely.geometry import MultiPolygon, Polygon, box
+from shapely.geometry.polygon import orient
+
+from . import tools
+
+# --- API ---
+OCCURRENCE_SEARCH_URL = "https://api.gbif.org/v1/occurrence/search"
+# maximum page size and maximum offset + limit of the search API
+PAGE_LIMIT = 300
+OFFSET_LIMIT = 100000
+REQUEST_TIMEOUT = 60
+
+# --- Harvesting ---
+MAX_WORKERS = 4
+RATE_LIMIT = 5.0
+MAX_RETRIES = 5
+BACKOFF = 1.0
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# --- Tiling ---
+MAX_TILE_DEPTH = 12
+WKT_PRECISION = 6
+
+Tile = namedtuple('Tile', 'geometry, count, depth')
+
+# --- Schema ---
+# pandas dtypes of occurrence columns kept by occurrence_frame(),
+# other (e.g. nested) fields of the search results are dropped
+OCCURRENCE_SCHEMA = {
+    "key": "int64",
+    "datasetKey": "category",
+    "publishingOrgKey": "category",
+    "basisOfRecord": "category",
+    "occurrenceStatus": "category",
+    "countryCode": "category",
+    "stateProvince": "category",
+    "taxonKey": "Int64",
+    "speciesKey": "Int64",
+    "species": "category",
+    "scientificName": "category",
+    "taxonRank": "category",
+    "decimalLatitude": "float64",
+    "decimalLongitude": "float64",
+    "coordinateUncertaintyInMeters": "float64",
+    "individualCount": "Int32",
+    "year": "Int16",
+    "month": "Int8",
+    "day": "Int8",
+    "eventDate": "datetime64[ms, UTC]",
+    "lastInterpreted": "datetime64[ms, UTC]",
+    }
+
+# --- Store ---
+STORE_DIR = tools.CACHE_DIR / "gbif"
+COORDINATE_COLUMNS = ["decimalLatitude", "decimalLongitude"]
+
+
+class RateLimiter:
+    """Space calls at least 1/rate seconds apart, across threads"""
+    def __init__(self, rate: float = None):
+        if rate is None:
+            rate = RATE_LIMIT
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def retry_delay(
+        attempt: int, retry_after: str = None, backoff: float = None) -> float:
+    """Return seconds to wait before retrying: the Retry-After header
+    (if given in seconds), else exponential backoff with jitter"""
+    if backoff is None:
+        backoff = BACKOFF
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return backoff * 2 ** attempt * (0.5 + random.random() / 2)
+
+
+def fetch_page(
+        params: Dict, offset: int, limit: int = None, url: str = None,
+        session: requests.Session = None, rate_limiter: RateLimiter = None,
+        max_retries: int = None) -> Dict:
+    """Fetch a single page of occurrence search results (parsed json)"""
+    if limit is None:
+        limit = PAGE_LIMIT
+    if url is None:
+        url = OCCURRENCE_SEARCH_URL
+    if session is None:
+        session = tools.get_session()
+    if max_retries is None:
+        max_retries = MAX_RETRIES
+    page_params = {**params, "offset": offset, "limit": limit}
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait()
+        try:
+            response = session.get(
+                url, params=page_params, timeout=REQUEST_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            time.sleep(retry_delay(attempt))
+            continue
+        if response.status_code in RETRY_STATUS and attempt < max_retries:
+            time.sleep(retry_delay(
+                attempt, response.headers.get("Retry-After")))
+            continue
+        response.raise_for_status()
+        return response.json()
+
+
+def count_occurrences(
+        params: Dict, url: str = None, session: requests.Session = None,
+        rate_limiter: RateLimiter = None) -> int:
+    """Return the number of occurrences for search params (limit=0)"""
+    return fetch_page(
+        params, 0, 0, url, session, rate_limiter).get("count", 0)
+
+
+def occurrence_frame(
+        records: List[Dict], schema: Dict[str, str] = None) -> pd.DataFrame:
+    """Build a DataFrame from json records with the dtypes of schema
+    (OCCURRENCE_SCHEMA by default)
+
+    Records are read column-wise into Arrow arrays, without an
+    intermediate frame of Python objects. Categories are dictionary
+    encoded in Arrow, missing integers become <NA>. Dates that are
+    not a single point in time (e.g. ranges 2020-05/2020-06) become NaT.
+    """
+    import pyarrow as pa
+    if schema is None:
+        schema = OCCURRENCE_SCHEMA
+    arrow_types = {
+        "category": pa.string(), "float64": pa.float64()}
+    arrow_schema = pa.schema([
+        (col, pa.string() if dtype.startswith("datetime")
+         else arrow_types.get(dtype, pa.int64()))
+        for col, dtype in schema.items()])
+    table = pa.Table.from_pylist(records, schema=arrow_schema)
+    for col, dtype in schema.items():
+        if dtype == "category":
+            table = table.set_column(
+                table.column_names.index(col), col,
+                table[col].dictionary_encode())
+    df = table.to_pandas(types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+    for col, dtype in schema.items():
+        if dtype.startswith("datetime"):
+            df[col] = pd.to_datetime(
+                df[col], format="ISO8601", utc=True,
+                errors="coerce").astype(dtype)
+        elif dtype != "category":
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def concat_frames(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate frames, keeping columns categorical that are
+    categorical in all frames (with the union of categories)"""
+    categorical = set.intersection(*(
+        set(df.select_dtypes("category").columns) for df in frames))
+    df = pd.concat(frames, axis=0, ignore_index=True, sort=True)
+    for col in categorical:
+        if df[col].dtype != "category":
+            df[col] = df[col].astype("category")
+    return df
+
+
+def parquet_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Serialize nested values (lists, dicts, e.g. media or gadm)
+    as json strings, so that pages can be stored as Parquet"""
+    for col in df.columns[df.dtypes == object]:
+        nested = df[col].map(lambda value: isinstance(value, (list, dict)))
+        if nested.any():
+            df[col] = df[col].where(
+                ~nested, df[col][nested].map(json.dumps))
+    return df
+
+
+def harvest_occurrences(
+        params: Dict, output: Path = None, url: str = None,
+        limit: int = None, max_records: int = None, max_workers: int = None,
+        rate: float = None, report: bool = None,
+        raw: bool = None) -> Union[pd.DataFrame, Path]:
+    """Retrieve all occurrences for search params (up to the offset
+    limit of the API), fetching pages concurrently
+
+    The first page reports the total count; remaining pages are
+    requested in max_workers threads, at most rate requests per
+    second. Pages after the first endOfRecords answer are cancelled.
+
+    Args:
+        params: Search parameters, e.g. {"taxon_key": .., "geometry": ..}.
+        output: If set, each page is written to output/part-{offset}.parquet
+            (see read_occurrences), instead of being kept in memory.
+        url: Search API url (e.g. of a local stub server). Defaults to
+            OCCURRENCE_SEARCH_URL.
+        limit: Records per page. Defaults to PAGE_LIMIT.
+        max_records: Stop after max_records. Defaults to OFFSET_LIMIT.
+        max_workers: Concurrent requests. Defaults to MAX_WORKERS.
+        rate: Maximum requests per second. Defaults to RATE_LIMIT.
+        report: Show progress (default).
+        raw: Keep all fields of the results as returned (nested values
+            as Python objects), instead of the columns and dtypes of
+            OCCURRENCE_SCHEMA.
+
+    Returns a DataFrame of all records (ordered by offset), or output.
+    """
+    if limit is None:
+        limit = PAGE_LIMIT
+    if max_records is None:
+        max_records = OFFSET_LIMIT
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if report is None:
+        report = True
+    if raw is None:
+        raw = False
+    max_records = min(max_records, OFFSET_LIMIT)
+    params = {
+        key: value for key, value in params.items()
+        if key not in ("offset", "limit")}
+    if output is not None:
+        output = Path(output)
+        output.mkdir(parents=True, exist_ok=True)
+    session = tools.get_session()
+    rate_limiter = RateLimiter(rate)
+    frames = {}
+    progress = tools.Progress(
+        label="Retrieved", unit="records", scale=1,
+        backend=None if report else "none")
+
+    def page_limit(offset: int) -> int:
+        return min(limit, max_records - offset)
+
+    def store(offset: int, page: Dict):
+        records = page["results"]
+        progress.add(len(records))
+        if not records:
+            return
+        df = pd.DataFrame.from_records(records) if raw \
+            else occurrence_frame(records)
+        if output is None:
+            frames[offset] = df
+            return
+        parquet_frame(df).to_parquet(output / f"part-{offset:06d}.parquet")
+
+    first_page = fetch_page(
+        params, 0, page_limit(0), url, session, rate_limiter)
+    progress.total = min(first_page.get("count", max_records), max_records)
+    store(0, first_page)
+    if not first_page["endOfRecords"]:
+        offsets = range(limit, progress.total, limit)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(
+                    fetch_page, params, offset, page_limit(offset), url,
+                    session, rate_limiter): offset
+                for offset in offsets}
+            end_offset = None
+            try:
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        # beyond endOfRecords
+                        continue
+                    offset = futures[future]
+                    page = future.result()
+                    if page["endOfRecords"] and (
+                            end_offset is None or offset < end_offset):
+                        # later pages are empty (or beyond the records)
+                        end_offset = offset
+                        for other, other_offset in futures.items():
+                            if other_offset > end_offset:
+                                other.cancel()
+                    if end_offset is not None and offset > end_offset:
+                        continue
+                    store(offset, page)
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    progress.close()
+    if output is not None:
+        return output
+    if not frames:
+        return pd.DataFrame()
+    return concat_frames([frames[offset] for offset in sorted(frames)])
+
+
+def read_frame(file: Path, columns: List[str] = None) -> pd.DataFrame:
+    """Read a Parquet file of occurrences
+
+    Categorical columns without any value (e.g. stateProvince missing
+    in all records of a page) are stored with Arrow type null and read
+    as object; their category dtype of OCCURRENCE_SCHEMA is restored,
+    so that concat_frames keeps the column categorical.
+    """
+    df = pd.read_parquet(file, columns=columns)
+    for col, dtype in OCCURRENCE_SCHEMA.items():
+        if (dtype == "category" and col in df
+                and df[col].dtype == object and df[col].isna().all()):
+            df[col] = df[col].astype("category")
+    return df
+
+
+def read_occurrences(path: Path) -> pd.DataFrame:
+    """Read occurrences written by harvest_occurrences(output=path)"""
+    files = sorted(Path(path).glob("part-*.parquet"))
+    if not files:
+        return pd.DataFrame()
+    return concat_frames([read_frame(file) for file in files])
+
+
+def geometry_wkt(geometry: Union[str, Polygon, MultiPolygon]) -> str:
+    """Return (Multi)Polygon geometry as WKT with anticlockwise
+    ordering of points, as required by the search API"""
+    if isinstance(geometry, str):
+        geometry = shapely_wkt.loads(geometry)
+    if isinstance(geometry, MultiPolygon):
+        geometry = MultiPolygon([orient(part, 1.0) for part in geometry.geoms])
+    else:
+        geometry = orient(geometry, 1.0)
+    return shapely_wkt.dumps(
+        geometry, rounding_precision=WKT_PRECISION, trim=True)
+
+
+def quarter_geometry(
+        geometry: Union[Polygon, MultiPolygon]) -> List[Polygon]:
+    """Split geometry at the center of its bounds into up to four
+    (non-empty) quadrants"""
+    minx, miny, maxx, maxy = geometry.bounds
+    midx, midy = (minx + maxx) / 2, (miny + maxy) / 2
+    quadrants = []
+    for quadrant in (
+            box(minx, miny, midx, midy), box(midx, miny, maxx, midy),
+            box(minx, midy, midx, maxy), box(midx, midy, maxx, maxy)):
+        part = quadrant if geometry.equals(geometry.envelope) \
+            else geometry.intersection(quadrant)
+        if isinstance(part, (Polygon, MultiPolygon)) and part.area > 0:
+            quadrants.append(part)
+        elif hasattr(part, "geoms"):
+            polygons = [
+                geom for geom in part.geoms
+                if isinstance(geom, Polygon) and geom.area > 0]
+            if polygons:
+                quadrants.append(MultiPolygon(polygons))
+    return quadrants
+
+
+def split_tiles(
+        params: Dict, geometry: Union[str, Polygon, MultiPolygon],
+        max_count: int = None, max_depth: int = None, url: str = None,
+        session: requests.Session = None, rate_limiter: RateLimiter = None,
+        max_workers: int = None) -> List[Tile]:
+    """Recursively split geometry into quadtree tiles until the
+    occurrence count of each tile is below max_count
+
+    Counts of all tiles of one level are requested concurrently.
+    Tiles without occurrences are dropped; tiles at max_depth
+    are kept even if above max_count.
+    """
+    if max_count is None:
+        max_count = OFFSET_LIMIT
+    if max_depth is None:
+        max_depth = MAX_TILE_DEPTH
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if isinstance(geometry, str):
+        geometry = shapely_wkt.loads(geometry)
+    tiles = []
+    level = [geometry]
+    depth = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while level:
+            counts = executor.map(
+                lambda geom: count_occurrences(
+                    {**params, "geometry": geometry_wkt(geom)},
+                    url, session, rate_limiter), level)
+            next_level = []
+            for geom, count in zip(level, counts):
+                if not count:
+                    continue
+                if count < max_count or depth == max_depth:
+                    if count >= max_count:
+                        print(
+                            f"Tile at max_depth {max_depth} has {count:,} "
+                            f"occurrences, only {max_count:,} retrieved.")
+                    tiles.append(Tile(geometry_wkt(geom), count, depth))
+                    continue
+                next_level.extend(quarter_geometry(geom))
+            level = next_level
+            depth += 1
+    return tiles
+
+
+def harvest_tiles(
+        params: Dict, geometry: Union[str, Polygon, MultiPolygon],
+        output: Path = None, url: str = None, limit: int = None,
+        max_workers: int = None, rate: float = None,
+        report: bool = None, raw: bool = None) -> Union[pd.DataFrame, Path]:
+    """Retrieve all occurrences within geometry, past the offset limit
+    of the API, by splitting geometry into quadtree tiles (split_tiles)
+
+    Pages of all tiles are fetched concurrently, at most rate requests
+    per second. Occurrences on shared tile edges are returned in both
+    tiles and are removed by their GBIF key.
+
+    Args:
+        params: Search parameters, without geometry.
+        geometry: Polygon (or WKT) of the query area, e.g. the WKT
+            of the bounding box of Saxony.
+        output: If set, each page is written to
+            output/part-{tile}-{offset}.parquet (see read_occurrences).
+        url, limit, max_workers, rate, report, raw: See
+            harvest_occurrences.
+
+    Returns a DataFrame of all records (ordered by tile and offset),
+    or output.
+    """
+    if limit is None:
+        limit = PAGE_LIMIT
+    if max_workers is None:
+        max_workers = MAX_WORKERS
+    if report is None:
+        report = True
+    if raw is None:
+        raw = False
+    params = {
+        key: value for key, value in params.items()
+        if key not in ("offset", "limit", "geometry")}
+    if output is not None:
+        output = Path(output)
+        output.mkdir(parents=True, exist_ok=True)
+    session = tools.get_session()
+    rate_limiter = RateLimiter(rate)
+    tiles = split_tiles(
+        params, geometry, url=url, session=session,
+        rate_limiter=rate_limiter, max_workers=max_workers)
+    pages = {
+        (tile_ix, offset): (
+            {**params, "geometry": tile.geometry},
+            min(limit, OFFSET_LIMIT - offset))
+        for tile_ix, tile in enumerate(tiles)
+        for offset in range(0, min(tile.count, OFFSET_LIMIT), limit)}
+    frames = {}
+    seen_keys = set()
+    progress = tools.Progress(
+        total=sum(min(tile.count, OFFSET_LIMIT) for tile in tiles),
+        label="Retrieved", unit="records", scale=1,
+        backend=None if report else "none")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                fetch_page, page_params, offset, page_limit, url,
+                session, rate_limiter): (tile_ix, offset)
+            for (tile_ix, offset), (page_params, page_limit) in pages.items()}
+        try:
+            for future in as_completed(futures):
+                tile_ix, offset = futures[future]
+                records = future.result()["results"]
+                progress.add(len(records))
+                # drop occurrences already retrieved from a neighbouring tile
+                records = [
+                    record for record in records
+                    if record["key"] not in seen_keys]
+                seen_keys.update(record["key"] for record in records)
+                if not records:
+                    continue
+                df = pd.DataFrame.from_records(records) if raw \
+                    else occurrence_frame(records)
+                if output is None:
+                    frames[tile_ix, offset] = df
+                    continue
+                parquet_frame(df).to_parquet(
+                    output / f"part-{tile_ix:04d}-{offset:06d}.parquet")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    progress.close()
+    if output is not None:
+        return output
+    if not frames:
+        return pd.DataFrame()
+    return concat_frames([frames[page] for page in sorted(frames)])
+
+
+class OccurrenceStore:
+    """Incremental store of harvested occurrences
+
+    Occurrences are stored as a Parquet dataset, partitioned by
+    taxonKey and region (taxonKey=../region=../occurrences.parquet).
+    For each partition, the latest lastInterpreted timestamp is
+    recorded in state.json. A refresh only requests occurrences
+    interpreted since that date (lastInterpreted range filter) and
+    merges them into the partition by occurrence key, replacing
+    changed records.
+
+    Occurrences deleted from GBIF are not detected by a refresh;
+    use refresh(.., full=True) to rebuild a partition.
+    """
+    def __init__(self, path: Path = None):
+        if path is None:
+            path = STORE_DIR
+        self.path = Path(path)
+        self.state_file = self.path / "state.json"
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _load_state(self) -> Dict[str, Dict]:
+        if not self.state_file.exists():
+            return {}
+        try:
+            return json.loads(self.state_file.read_text())
+        except ValueError:
+            return {}
+
+    def _save_state(self, state: Dict[str, Dict]):
+        tmp_file = self.state_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(state, indent=1))
+        os.replace(tmp_file, self.state_file)
+
+    @staticmethod
+    def partition(taxon_key: int, region: str) -> str:
+        """Return partition name (relative path) for taxon_key and region"""
+        return f"taxonKey={taxon_key}/region={region}"
+
+    def partition_file(self, taxon_key: int, region: str) -> Path:
+        return self.path / self.partition(taxon_key, region) \
+            / "occurrences.parquet"
+
+    def last_interpreted(self, taxon_key: int, region: str) -> Optional[str]:
+        """Return latest lastInterpreted timestamp of a partition
+        (None if unknown or not a valid timestamp)"""
+        entry = self._load_state().get(self.partition(taxon_key, region))
+        if entry is None or not entry.get("last_interpreted"):
+            return
+        try:
+            timestamp = pd.Timestamp(entry["last_interpreted"])
+        except (TypeError, ValueError):
+            return
+        if pd.isna(timestamp):
+            return
+        return entry["last_interpreted"]
+
+    def refresh(
+            self, taxon_key: int, region: str,
+            geometry: Union[str, Polygon, MultiPolygon],
+            params: Dict = None, full: bool = None, **kwargs) -> int:
+        """Retrieve new or changed occurrences of taxon_key within
+        geometry (the region) and merge them into the partition
+
+        Args:
+            taxon_key: GBIF taxon key.
+            region: Name of the region, e.g. "sachsen".
+            geometry: Polygon (or WKT) of the region.
+            params: Further search parameters, e.g. {"continent": ..}.
+                Should be the same for every refresh of a partition.
+            full: Retrieve all occurrences, even if the partition exists.
+            kwargs: Passed to harvest_tiles (e.g. max_workers, rate).
+
+        Returns the number of new or changed occurrences.
+        """
+        if params is None:
+            params = {}
+        if full is None:
+            full = False
+        file = self.partition_file(taxon_key, region)
+        since = None
+        if not full and file.exists():
+            # without a valid state, the partition is rebuilt
+            since = self.last_interpreted(taxon_key, region)
+        query = {**params, "taxon_key": taxon_key}
+        if since is not None:
+            # date granularity: the last day is retrieved again
+            # and merged by key
+            query["lastInterpreted"] = f"{since[:10]},*"
+        df = harvest_tiles(query, geometry, **kwargs)
+        retrieved = len(df)
+        if not retrieved:
+            return 0
+        df = parquet_frame(df)
+        if since is not None:
+            stored = read_frame(file)
+            stored = stored[~stored["key"].isin(df["key"])]
+            df = concat_frames([stored, df])
+        df = df.sort_values("key", ignore_index=True)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = file.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(tmp_file, index=False)
+        os.replace(tmp_file, file)
+        latest = pd.NaT
+        if "lastInterpreted" in df:
+            latest = pd.to_datetime(
+                df["lastInterpreted"], format="ISO8601", utc=True,
+                errors="coerce").max()
+        state = self._load_state()
+        if pd.isna(latest):
+            # no lastInterpreted dates: next refresh is a full harvest
+            state.pop(self.partition(taxon_key, region), None)
+        else:
+            state[self.partition(taxon_key, region)] = {
+                "last_interpreted": latest.isoformat(),
+                "records": len(df),
+                "refreshed": time.time(),
+                }
+        self._save_state(state)
+        return retrieved
+
+    def load(
+            self, taxon_key: int = None, region: str = None,
+            columns: List[str] = None) -> pd.DataFrame:
+        """Read occurrences of the store, optionally only of one
+        taxon_key and/or region, and only for columns (e.g.
+        COORDINATE_COLUMNS); only the selected columns are read
+        from disk"""
+        if taxon_key is None:
+            taxon_key = "*"
+        if region is None:
+            region = "*"
+        files = sorted(self.path.glob(
+            f"{self.partition(taxon_key, region)}/occurrences.parquet"))
+        if not files:
+            return pd.DataFrame(columns=columns)
+        return concat_frames(
+            [read_frame(file, columns=columns) for file in files])
@@ -0,0 +1,387 @@
+"""
+hll.py – Local HyperLogLog engine, compatible with the storage format
+of postgresql-hll (https://github.com/citusdata/postgresql-hll).
+
+Decodes hll sets (hex strings, e.g. '\\x138b40..') into NumPy arrays,
+unions them per group (hll_union_agg) and estimates cardinalities
+(hll_cardinality) without a database connection. Representations
+(EMPTY, EXPLICIT, SPARSE, FULL), the promotion from EXPLICIT to
+compressed registers and the bias correction follow postgresql-hll,
+see STORAGE.md and hll.c of the extension.
+
+Author: Dr.-Ing. Alexander Dunkel
+License: MIT License
+"""
+
+from collections import namedtuple
+from typing import List, Sequence
+
+import numpy as np
+
+# --- Storage format ---
+SCHEMA_VERSION = 1
+HLL_UNDEFINED = 0
+HLL_EMPTY = 1
+HLL_EXPLICIT = 2
+HLL_SPARSE = 3
+HLL_FULL = 4
+# SPARSE and FULL are both decoded to registers
+HLL_COMPRESSED = 5
+
+HllParams = namedtuple('Hll_params', 'log2m, regwidth, expthresh, sparseon')
+
+
+def parse_params(raw: bytes) -> HllParams:
+    """Parse parameter and cutoff bytes of an hll header"""
+    regwidth = (raw[1] >> 5) + 1
+    log2m = raw[1] & 0x1f
+    sparseon = (raw[2] >> 6) & 0x01
+    expthresh_encoded = raw[2] & 0x3f
+    if expthresh_encoded == 63:
+        expthresh = -1
+    elif expthresh_encoded == 0:
+        expthresh = 0
+    else:
+        expthresh = 1 << (expthresh_encoded - 1)
+    return HllParams(log2m, regwidth, expthresh, sparseon)
+
+
+def header_bytes(hll_type: int, params: HllParams) -> bytes:
+    """Return the 3-byte header for hll_type and params"""
+    if params.expthresh == -1:
+        expthresh_encoded = 63
+    elif params.expthresh == 0:
+        expthresh_encoded = 0
+    else:
+        expthresh_encoded = int(params.expthresh).bit_length()
+    return bytes([
+        (SCHEMA_VERSION << 4) | hll_type,
+        ((params.regwidth - 1) << 5) | params.log2m,
+        (params.sparseon << 6) | expthresh_encoded])
+
+
+def explicit_threshold(params: HllParams) -> int:
+    """Return max. number of EXPLICIT elements, before the
+    set is promoted to registers (auto: size of FULL in int64)"""
+    if params.expthresh == -1:
+        full_bytes = (params.regwidth * (1 << params.log2m) + 7) // 8
+        return full_bytes // 8
+    return params.expthresh
+
+
+def _unpack_entries(
+        payload: np.ndarray, byte_offsets: np.ndarray,
+        byte_lengths: np.ndarray, width: int) -> np.ndarray:
+    """Unpack big-endian bit-packed entries of width bits from
+    concatenated payloads (each padded to full bytes)
+
+    Returns entries and the number of entries per payload.
+    """
+    bits = np.unpackbits(payload)
+    counts = (byte_lengths * 8) // width
+    total = int(counts.sum())
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    starts = np.repeat(byte_offsets * 8, counts) + \
+        width * (np.arange(total) - first)
+    bit_matrix = bits[starts[:, None] + np.arange(width)]
+    weights = np.left_shift(
+        np.uint64(1), np.arange(width - 1, -1, -1, dtype=np.uint64))
+    entries = bit_matrix.astype(np.uint64) @ weights
+    return entries, counts
+
+
+def _pack_entries(entries: np.ndarray, width: int) -> bytes:
+    """Pack entries big-endian into width bits each, padded to full bytes"""
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+    bits = (entries.astype(np.uint64)[:, None] >> shifts) & np.uint64(1)
+    return np.packbits(bits.astype(np.uint8).ravel()).tobytes()
+
+
+def add_explicit(
+        registers: np.ndarray, rows: np.ndarray,
+        values: np.ndarray, params: HllParams):
+    """Add hashed values (int64) to registers[rows] (in place)
+
+    The lowest log2m bits select the register, the register value is
+    the one-based position of the lowest set bit of the remaining bits,
+    capped at the largest value that fits into regwidth bits.
+    """
+    if not len(values):
+        return
+    unsigned = values.astype(np.int64).view(np.uint64)
+    index = (unsigned & np.uint64((1 << params.log2m) - 1)).astype(np.intp)
+    w = unsigned >> np.uint64(params.log2m)
+    nonzero = w != 0
+    w = w[nonzero]
+    lowest_bit = w & (~w + np.uint64(1))
+    p_w = np.log2(lowest_bit.astype(np.float64)).astype(np.int64) + 1
+    p_w = np.minimum(p_w, (1 << params.regwidth) - 1).astype(np.uint8)
+    np.maximum.at(registers, (rows[nonzero], index[nonzero]), p_w)
+
+
+class HllSets:
+    """A batch of decoded hll sets with equal parameters
+
+    Stored column-wise: kinds per set (HLL_UNDEFINED, HLL_EMPTY,
+    HLL_EXPLICIT or HLL_COMPRESSED), explicit elements as one int64
+    array with offsets per set, and the registers of compressed sets as
+    a 2D uint8 array (register_rows maps sets to rows, -1 if none).
+    mixed_params is True, if the decoded sets differ in their
+    explicit threshold or sparse flag (see union_agg).
+    """
+    def __init__(
+            self, params: HllParams, kinds: np.ndarray,
+            explicit_offsets: np.ndarray, explicit_values: np.ndarray,
+            registers: np.ndarray, register_rows: np.ndarray,
+            mixed_params: bool = False):
+        self.params = params
+        self.mixed_params = mixed_params
+        self.kinds = kinds
+        self.explicit_offsets = explicit_offsets
+        self.explicit_values = explicit_values
+        self.registers = registers
+        self.register_rows = register_rows
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    @property
+    def explicit_counts(self) -> np.ndarray:
+        return np.diff(self.explicit_offsets)
+
+
+def decode(hll_values: Sequence[str]) -> HllSets:
+    """Decode hll sets (hex strings as returned by postgres)
+
+    All sets must share log2m and regwidth; the explicit threshold
+    and sparse flag of the first set are used for unions (which
+    raise, if they differ between sets).
+    """
+    raws = [
+        bytes.fromhex(value[2:] if value.startswith('\\x') else value)
+        for value in hll_values]
+    count = len(raws)
+    types = np.fromiter(
+        (raw[0] & 0x0f for raw in raws), dtype=np.uint8, count=count)
+    params = None
+    mixed_params = False
+    for raw in raws:
+        if raw[0] >> 4 != SCHEMA_VERSION:
+            raise ValueError(f"Unknown hll schema version {raw[0] >> 4}")
+        if raw[0] & 0x0f == HLL_UNDEFINED:
+            continue
+        raw_params = parse_params(raw)
+        if params is None:
+            params = raw_params
+        elif raw_params[:2] != params[:2]:
+            raise ValueError(
+                f"hll parameters do not match: {raw_params} {params}")
+        elif raw_params != params:
+            mixed_params = True
+    if params is None:
+        # only undefined sets (or none at all): use postgres defaults
+        params = HllParams(11, 5, -1, 1)
+    m = 1 << params.log2m
+    kinds = types.copy()
+    kinds[(types == HLL_SPARSE) | (types == HLL_FULL)] = HLL_COMPRESSED
+    # EXPLICIT: 8-byte big-endian signed integers
+    explicit_ix = np.flatnonzero(types == HLL_EXPLICIT)
+    explicit_payloads = [raws[ix][3:] for ix in explicit_ix]
+    explicit_counts = np.zeros(count, dtype=np.int64)
+    explicit_counts[explicit_ix] = [
+        len(payload) // 8 for payload in explicit_payloads]
+    explicit_values = np.frombuffer(
+        b''.join(explicit_payloads), dtype='>i8').astype(np.int64)
+    explicit_offsets = np.concatenate(
+        [[0], np.cumsum(explicit_counts)]).astype(np.int64)
+    # SPARSE and FULL: registers
+    compressed_ix = np.flatnonzero(kinds == HLL_COMPRESSED)
+    register_rows = np.full(count, -1, dtype=np.int64)
+    register_rows[compressed_ix] = np.arange(len(compressed_ix))
+    registers = np.zeros((len(compressed_ix), m), dtype=np.uint8)
+    full_ix = np.flatnonzero(types == HLL_FULL)
+    if len(full_ix):
+        full_bytes = (params.regwidth * m + 7) // 8
+        payload = np.frombuffer(
+            b''.join(raws[ix][3:3 + full_bytes] for ix in full_ix),
+            dtype=np.uint8).reshape(len(full_ix), full_bytes)
+        bits = np.unpackbits(payload, axis=1)[:, :m * params.regwidth]
+        weights = 1 << np.arange(params.regwidth - 1, -1, -1)
+        registers[register_rows[full_ix]] = (
+            bits.reshape(len(full_ix), m, params.regwidth) @ weights
+            ).astype(np.uint8)
+    sparse_ix = np.flatnonzero(types == HLL_SPARSE)
+    if len(sparse_ix):
+        sparse_payloads = [raws[ix][3:] for ix in sparse_ix]
+        byte_lengths = np.array(
+            [len(payload) for payload in sparse_payloads], dtype=np.int64)
+        entries, counts = _unpack_entries(
+            np.frombuffer(b''.join(sparse_payloads), dtype=np.uint8),
+            np.cumsum(byte_lengths) - byte_lengths, byte_lengths,
+            params.log2m + params.regwidth)
+        rows = np.repeat(register_rows[sparse_ix], counts)
+        index = (entries >> np.uint64(params.regwidth)).astype(np.intp)
+        values = (entries & np.uint64((1 << params.regwidth) - 1)).astype(np.uint8)
+        # skip zero-valued padding entries
+        filled = values > 0
+        registers[rows[filled], index[filled]] = values[filled]
+    return HllSets(
+        params, kinds, explicit_offsets, explicit_values,
+        registers, register_rows, mixed_params)
+
+
+def union_agg(hll_sets: HllSets, groups: np.ndarray) -> HllSets:
+    """Union hll sets per group (as hll_union_agg ... GROUP BY)
+
+    Args:
+        hll_sets: Decoded sets
+        groups: Group number (0..n-1) per set
+
+    Returns one set per group, ordered by group number.
+
+    Raises ValueError for sets with different explicit thresholds
+    or sparse flags, as postgresql-hll does for unions of such sets.
+    """
+    if hll_sets.mixed_params:
+        raise ValueError(
+            "hll sparse enable or explicit threshold does not match")
+    params = hll_sets.params
+    m = 1 << params.log2m
+    groups = np.asarray(groups, dtype=np.int64)
+    num_groups = int(groups.max()) + 1 if len(groups) else 0
+    kinds = np.full(num_groups, HLL_EMPTY, dtype=np.uint8)
+    # distinct explicit elements per group
+    element_groups = np.repeat(groups, hll_sets.explicit_counts)
+    order = np.lexsort((hll_sets.explicit_values, element_groups))
+    element_groups = element_groups[order]
+    elements = hll_sets.explicit_values[order]
+    distinct = np.ones(len(elements), dtype=bool)
+    distinct[1:] = (element_groups[1:] != element_groups[:-1]) | \
+        (elements[1:] != elements[:-1])
+    element_groups = element_groups[distinct]
+    elements = elements[distinct]
+    distinct_counts = np.bincount(element_groups, minlength=num_groups)
+    # groups stored as registers: those with any compressed member,
+    # and those with more distinct elements than the explicit threshold
+    compressed_member = hll_sets.register_rows >= 0
+    compressed = np.zeros(num_groups, dtype=bool)
+    compressed[groups[compressed_member]] = True
+    compressed |= distinct_counts > explicit_threshold(params)
+    kinds[distinct_counts > 0] = HLL_EXPLICIT
+    kinds[compressed] = HLL_COMPRESSED
+    # union with an undefined set is undefined
+    kinds[groups[hll_sets.kinds == HLL_UNDEFINED]] = HLL_UNDEFINED
+    compressed &= kinds != HLL_UNDEFINED
+    register_rows = np.full(num_groups, -1, dtype=np.int64)
+    register_rows[compressed] = np.arange(int(compressed.sum()))
+    registers = np.zeros((int(compressed.sum()), m), dtype=np.uint8)
+    member_ix = np.flatnonzero(compressed_member & compressed[groups])
+    if len(member_ix):
+        member_ix = member_ix[np.argsort(groups[member_ix], kind='stable')]
+        member_groups = groups[member_ix]
+        starts = np.flatnonzero(np.concatenate(
+            [[True], member_groups[1:] != member_groups[:-1]]))
+        sizes = np.diff(np.append(starts, len(member_ix)))
+        rank = np.arange(len(member_ix)) - np.repeat(starts, sizes)
+        # register-wise maximum per group, one vectorised step per rank
+        # (the k-th member of all groups at once); for uint8 rows,
+        # this is much faster than np.maximum.reduceat(.., axis=0)
+        for k in range(int(sizes.max())):
+            at_rank = rank == k
+            rows = register_rows[member_groups[at_rank]]
+            registers[rows] = np.maximum(
+                registers[rows],
+                hll_sets.registers[hll_sets.register_rows[member_ix[at_rank]]])
+    to_registers = compressed[element_groups]
+    add_explicit(
+        registers, register_rows[element_groups[to_registers]],
+        elements[to_registers], params)
+    keep_explicit = kinds[element_groups] == HLL_EXPLICIT
+    explicit_counts = np.bincount(
+        element_groups[keep_explicit], minlength=num_groups)
+    return HllSets(
+        params, kinds,
+        np.concatenate([[0], np.cumsum(explicit_counts)]).astype(np.int64),
+        elements[keep_explicit], registers, register_rows)
+
+
+def alpha_m_squared(m: int) -> float:
+    """Bias correction constant alpha * m^2"""
+    if m == 16:
+        alpha = 0.673
+    elif m == 32:
+        alpha = 0.697
+    elif m == 64:
+        alpha = 0.709
+    else:
+        alpha = 0.7213 / (1.0 + 1.079 / m)
+    return alpha * m * m
+
+
+def cardinality(hll_sets: HllSets) -> np.ndarray:
+    """Estimate cardinality per set (as hll_cardinality)
+
+    EXPLICIT sets return the exact number of elements, registers
+    the HyperLogLog estimate with small and large range correction.
+    Undefined sets return NaN (NULL in postgres).
+    """
+    params = hll_sets.params
+    m = 1 << params.log2m
+    result = np.zeros(len(hll_sets), dtype=np.float64)
+    result[hll_sets.kinds == HLL_UNDEFINED] = np.nan
+    explicit = hll_sets.kinds == HLL_EXPLICIT
+    result[explicit] = hll_sets.explicit_counts[explicit]
+    compressed = np.flatnonzero(hll_sets.kinds == HLL_COMPRESSED)
+    if not len(compressed):
+        return result
+    registers = hll_sets.registers[hll_sets.register_rows[compressed]]
+    # terms are powers of two, the sum is exact in float64
+    # for the common register widths (regardless of order)
+    register_sum = np.ldexp(1.0, -registers.astype(np.int64)).sum(axis=1)
+    zeros = (registers == 0).sum(axis=1)
+    estimator = alpha_m_squared(m) / register_sum
+    two_to_l = 2.0 ** ((1 << params.regwidth) - 2 + params.log2m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        small = m * np.log(m / zeros)
+        large = -1 * two_to_l * np.log(1.0 - (estimator / two_to_l))
+    result[compressed] = np.where(
+        (zeros != 0) & (estimator < 5.0 * m / 2.0), small,
+        np.where(estimator <= two_to_l / 30.0, estimator, large))
+    return result
+
+
+def encode(hll_sets: HllSets) -> List[str]:
+    """Encode sets to postgres hex strings ('\\x..')
+
+    Registers are written as SPARSE, if enabled and smaller
+    than FULL, otherwise as FULL.
+    """
+    params = hll_sets.params
+    m = 1 << params.log2m
+    full_bytes = (params.regwidth * m + 7) // 8
+    sparse_width = params.log2m + params.regwidth
+    encoded = []
+    for ix, kind in enumerate(hll_sets.kinds):
+        if kind == HLL_UNDEFINED:
+            raw = header_bytes(HLL_UNDEFINED, params)
+        elif kind == HLL_EMPTY:
+            raw = header_bytes(HLL_EMPTY, params)
+        elif kind == HLL_EXPLICIT:
+            values = hll_sets.explicit_values[
+                hll_sets.explicit_offsets[ix]:hll_sets.explicit_offsets[ix + 1]]
+            raw = header_bytes(HLL_EXPLICIT, params) + \
+                np.sort(values).astype('>i8').tobytes()
+        else:
+            registers = hll_sets.registers[hll_sets.register_rows[ix]]
+            filled = np.flatnonzero(registers)
+            sparse_bytes = (len(filled) * sparse_width + 7) // 8
+            if params.sparseon and sparse_bytes < full_bytes:
+                entries = (filled.astype(np.uint64) << np.uint64(params.regwidth)) | \
+                    registers[filled].astype(np.uint64)
+                raw = header_bytes(HLL_SPARSE, params) + \
+                    _pack_entries(entries, sparse_width)
+            else:
+                raw = header_bytes(HLL_FULL, params) + \
+                    _pack_entries(registers, params.regwidth)
+        encoded.append('\\x' + raw.hex())
+    return encoded
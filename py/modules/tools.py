@@ -6,80 +6,722 @@ License: MIT License
 Source: https://gitlab.hrz.tu-chemnitz.de/s7398234--tu-dresden.de/base_modules/
 """
 
+from __future__ import annotations
+
 # --- Standard Library ---
+import asyncio
 import base64
 import csv
 import fnmatch
+import hashlib
+import importlib
+import importlib.metadata
 import io
+import json
+import mmap
 import os
 import platform
+import queue
+import re
 import shutil
+import struct
+import sys
+import tempfile
 import textwrap
+import threading
+import time
+import types
 import warnings
 import zipfile
+import zlib
 from collections import namedtuple
+from contextlib import ExitStack, contextmanager, nullcontext
+from concurrent.futures import (
+    FIRST_COMPLETED, CancelledError, ThreadPoolExecutor, wait)
 from datetime import date
-from itertools import islice
+from itertools import count, islice
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
+try:
+    import fcntl
+except ImportError:
+    # Windows: cache index locks only cover threads of one process
+    fcntl = None
+
 # --- Third-Party Libraries ---
-import geopandas as gp
-import matplotlib.pyplot as plt
-import mapclassify as mc
 import numpy as np
 import pandas as pd
-import pkg_resources
-import requests
-from PIL import Image
-from adjustText import adjust_text
-from cartopy import crs
-from matplotlib import font_manager
-from matplotlib.font_manager import FontProperties
-from pyproj import Transformer
-import geoviews as gv
+
+class LazyModule(types.ModuleType):
+    """Module placeholder, imported on first attribute access"""
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        # later lookups are served from the placeholder namespace
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+# heavy packages, imported when first used
+gp = LazyModule("geopandas")
+plt = LazyModule("matplotlib.pyplot")
+mc = LazyModule("mapclassify")
+requests = LazyModule("requests")
+Image = LazyModule("PIL.Image")
+adjustText = LazyModule("adjustText")
+ccrs = LazyModule("cartopy.crs")
+font_manager = LazyModule("matplotlib.font_manager")
+mpl_colors = LazyModule("matplotlib.colors")
+pyproj = LazyModule("pyproj")
+gv = LazyModule("geoviews")
+
+# names previously imported from heavy packages: {name: (module, attr)}
+_LAZY_NAMES = {
+    "adjust_text": ("adjustText", "adjust_text"),
+    "crs": ("cartopy.crs", None),
+    "FontProperties": ("matplotlib.font_manager", "FontProperties"),
+    "Transformer": ("pyproj", "Transformer"),
+}
+
+def __getattr__(name: str):
+    if name not in _LAZY_NAMES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY_NAMES[name]
+    module = importlib.import_module(module_name)
+    if attr is None:
+        return module
+    return getattr(module, attr)
+
+# --- Local Modules ---
+from . import hll
 
 # --- Jupyter-Specific ---
-from IPython.display import HTML, Markdown as md, clear_output, display
+from IPython import get_ipython
+from IPython.display import HTML, Markdown as md, Pretty, clear_output, display
 from html import escape
 
 # --- Globals ---
 OUTPUT = Path.cwd().parents[0] / "out"
+DB_POOL_SIZE = 4
+DB_CHUNKSIZE = 10000
+
+# Postgres types of (psycopg2-adapted) Python parameter values
+PG_PARAM_TYPES = {
+    bool: "boolean",
+    int: "bigint",
+    float: "double precision",
+    str: "text",
+}
+
+def _pg_param_type(param) -> Optional[str]:
+    """Postgres type of a query parameter, declared in PREPARE
+
+    Lists are typed by their elements (e.g. hll sets as text[], cast
+    in the query with %s::hll[]). Returns None for other values
+    (None, dates, nested lists, ..).
+    """
+    if isinstance(param, (list, tuple)):
+        element_types = {_pg_param_type(value) for value in param}
+        if not element_types:
+            return "text[]"
+        if element_types == {"bigint", "double precision"}:
+            return "double precision[]"
+        if len(element_types) != 1:
+            return None
+        element_type = element_types.pop()
+        if element_type is None or element_type.endswith("[]"):
+            return None
+        return f"{element_type}[]"
+    for param_class, pg_type in PG_PARAM_TYPES.items():
+        if type(param) is param_class:
+            return pg_type
+    if isinstance(param, np.generic):
+        return _pg_param_type(param.item())
+    return None
+
+def prepare_statement(
+        name: str, sql_query: str, param_types: List[str]) -> str:
+    """PREPARE statement for sql_query with %s placeholders,
+    e.g. PREPARE name (text[]) AS SELECT .. unnest($1::hll[])"""
+    # %s placeholders to $1..$n, %% to %
+    positions = count(1)
+    statement = re.sub(
+        r"%([%s])",
+        lambda m: "%" if m.group(1) == "%" else f"${next(positions)}",
+        sql_query)
+    if not param_types:
+        return f"PREPARE {name} AS {statement}"
+    return f"PREPARE {name} ({', '.join(param_types)}) AS {statement}"
+
 class DbConn(object):
+    """Database connection helper (Postgres, DB-API)
 
-    def __init__(self, db_conn):
+    Args:
+        db_conn: An open DB-API connection (e.g. psycopg2.connect(..)).
+            If None, a first connection is created with connect.
+        connect: Optional factory returning new connections (e.g.
+            functools.partial(psycopg2.connect, host=.., ..)). Enables
+            a pool of up to pool_size connections, used by query_many.
+        pool_size: Maximum number of pooled connections. Defaults
+            to DB_POOL_SIZE with connect, otherwise to 1 (db_conn only).
+        cache: Optional QueryCache; results of queries with a version
+            or tables (or cache=True) are stored on disk and reused.
+    """
+    def __init__(
+            self, db_conn=None, connect: Callable = None, pool_size: int = None,
+            cache: 'QueryCache' = None):
+        if db_conn is None:
+            if connect is None:
+                raise ValueError("Either db_conn or connect is required")
+            db_conn = connect()
+        if pool_size is None:
+            pool_size = DB_POOL_SIZE
+        if connect is None:
+            pool_size = 1
         self.db_conn = db_conn
+        self.connect = connect
+        self.cache = cache
+        self.pool_size = max(pool_size, 1)
+        self._idle = queue.LifoQueue()
+        self._idle.put(db_conn)
+        self._connections = [db_conn]
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._cursor_ids = count()
+        # prepared statements per connection: {id(conn): {sql: name}}
+        self._prepared = {}
+        # connections of open query_iter: {id(conn): (thread id, conn)}
+        self._iter_conns = {}
+
+    def _checkout(self, wait: bool = True):
+        """Take an idle connection, open a new one (below pool_size)
+        or wait for one to be returned (None if not wait)"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = len(self._connections) < self.pool_size
+            if create:
+                # reserve slot, connect outside of lock
+                self._connections.append(None)
+        if not create:
+            if not wait:
+                return
+            return self._idle.get()
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._lock:
+                self._connections.remove(None)
+            raise
+        with self._lock:
+            self._connections[self._connections.index(None)] = conn
+        return conn
+
+    def _pinned(self):
+        """Connection pinned to the calling thread (see connection)"""
+        return getattr(self._local, "conn", None)
+
+    def _iter_conn(self):
+        """Connection of a query_iter consumed by the calling thread"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            for iter_thread, conn in self._iter_conns.values():
+                if iter_thread == thread_id:
+                    return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection for the with-block
+
+        The connection is pinned to the calling thread: all DbConn calls
+        inside the block use it (e.g. for temporary tables). Nested
+        blocks reuse the pinned connection.
+        """
+        pinned = self._pinned()
+        if pinned is not None:
+            yield pinned
+            return
+        shared = False
+        conn = self._checkout(wait=False)
+        if conn is None:
+            # pool exhausted: inside a query_iter loop, share the
+            # iterator's connection instead of waiting for it
+            conn = self._iter_conn()
+            shared = conn is not None
+        if conn is None:
+            conn = self._checkout()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if not shared:
+                self._idle.put(conn)
+
+    def query(
+            self, sql_query: str, params: Iterable = None,
+            prepare: bool = None, cache: bool = None, version: str = None,
+            tables: List[str] = None) -> pd.DataFrame:
+        """Execute Calculation SQL Query with pandas
 
-    def query(self, sql_query: str) -> pd.DataFrame:
-        """Execute Calculation SQL Query with pandas"""
-        with warnings.catch_warnings():
+        Args:
+            sql_query: SQL query, with %s placeholders for params.
+            params: Optional positional parameters, bound by the driver
+                (lists and arrays are sent as Postgres arrays, e.g.
+                for unnest(%s::hll[])).
+            prepare: If True (default with params), the query is
+                prepared once per connection and re-executed with new
+                parameters, reusing the query plan.
+            cache: Use the result cache (if self.cache is set). Defaults
+                to True if version or tables are given: other queries
+                (e.g. of temporary tables) are not cached.
+            version: Version of the queried data, part of the cache key.
+            tables: Source tables (or materialized views) of the query;
+                if no version is given, it is detected from their
+                modification counters (see table_version).
+        """
+        if cache is None:
+            cache = version is not None or bool(tables)
+        if not cache or self.cache is None:
+            return self._query(sql_query, params, prepare)
+        if version is None and tables:
+            version = self.table_version(tables)
+        key = self.cache.key(sql_query, params, version)
+        df = self.cache.get(key)
+        if df is None:
+            df = self._query(sql_query, params, prepare)
+            self.cache.put(key, df, sql_query)
+        return df
+
+    def _query(
+            self, sql_query: str, params: Iterable = None,
+            prepare: bool = None) -> pd.DataFrame:
+        if params is not None:
+            if prepare is None:
+                prepare = True
+            with self.connection() as conn:
+                cursor = self._execute_params(
+                    conn, sql_query, params, prepare)
+                columns = [col[0] for col in cursor.description]
+                df = pd.DataFrame.from_records(
+                    cursor.fetchall(), columns=columns)
+                cursor.close()
+            return df
+        with self.connection() as conn, warnings.catch_warnings():
             # ignore warning for non-SQLAlchemy Connecton
             # see github.com/pandas-dev/pandas/issues/45660
             warnings.simplefilter('ignore', UserWarning)
             # create pandas DataFrame from database query
-            df = pd.read_sql_query(sql_query, self.db_conn)
+            df = pd.read_sql_query(sql_query, conn)
         return df
 
-    def close(self):
-        self.db_conn.close()
+    def table_version(self, tables: List[str]) -> str:
+        """Return a version string for tables ("schema.table" or "table"),
+        which changes whenever rows are modified or a materialized view
+        is refreshed (pg_stat_user_tables counters and relfilenode)
+
+        Note that statistics are reported with a short delay.
+        """
+        df = self._query("""
+            SELECT schemaname, relname, n_tup_ins, n_tup_upd, n_tup_del,
+                   pg_relation_filenode(relid) AS filenode
+            FROM pg_stat_user_tables
+            WHERE schemaname || '.' || relname = ANY(%s)
+               OR relname = ANY(%s)
+            ORDER BY schemaname, relname
+            """, params=[list(tables), list(tables)], prepare=False)
+        return ";".join(
+            ",".join(str(value) for value in row)
+            for row in df.itertuples(index=False))
+
+    def _execute_params(
+            self, conn, sql_query: str, params: Iterable, prepare: bool):
+        """Execute query with bound parameters on conn, return cursor"""
+        params = [
+            param.tolist() if isinstance(param, np.ndarray) else param
+            for param in params]
+        cursor = conn.cursor()
+        driver = type(conn).__module__.split(".")[0]
+        if not prepare or driver not in ("psycopg", "psycopg2"):
+            cursor.execute(sql_query, params)
+        elif driver == "psycopg":
+            # psycopg 3 caches prepared statements per connection
+            cursor.execute(sql_query, params, prepare=True)
+        else:
+            # psycopg2: PREPARE once per connection, then EXECUTE
+            param_types = [_pg_param_type(param) for param in params]
+            if None in param_types:
+                # parameter type unknown: not prepared
+                cursor.execute(sql_query, params)
+                return cursor
+            name = self._prepare(conn, cursor, sql_query, param_types)
+            placeholders = ", ".join(["%s"] * len(params))
+            cursor.execute(f"EXECUTE {name} ({placeholders})", params)
+        return cursor
+
+    def _prepare(
+            self, conn, cursor, sql_query: str, param_types: List[str]) -> str:
+        """Server-side PREPARE of sql_query on conn (psycopg2),
+        returns the cached statement name"""
+        prepared = self._prepared.setdefault(id(conn), {})
+        key = (sql_query, tuple(param_types))
+        name = prepared.get(key)
+        if name is not None:
+            return name
+        name = "tools_" + hashlib.sha1(
+            repr(key).encode()).hexdigest()[:16]
+        cursor.execute(prepare_statement(name, sql_query, param_types))
+        prepared[key] = name
+        return name
+
+    def _server_cursor(self, conn):
+        """Named (server-side) cursor, if supported by the driver"""
+        name = f"tools_cursor_{next(self._cursor_ids)}"
+        try:
+            # psycopg2, psycopg 3; named cursors outside of
+            # a transaction (autocommit) must be held
+            return conn.cursor(
+                name=name, withhold=bool(getattr(conn, "autocommit", False)))
+        except TypeError:
+            # driver without server-side cursors
+            return conn.cursor()
+
+    def query_iter(
+            self, sql_query: str, chunksize: int = None) -> Iterator[pd.DataFrame]:
+        """Execute SQL Query and yield results as DataFrame chunks
+
+        Rows are fetched with a named (server-side) cursor, only
+        chunksize rows are held in client memory at a time.
+        Defaults to DB_CHUNKSIZE rows per chunk.
+
+        The iterator checks out its own pooled connection until it is
+        exhausted or closed; it is not pinned to the calling thread
+        (see connection). If the pool is exhausted, DbConn calls inside
+        the loop share the iterator's connection. query_iter inside a
+        connection() block or another query_iter loop requires a free
+        pooled connection (otherwise RuntimeError).
+        """
+        if chunksize is None:
+            chunksize = DB_CHUNKSIZE
+        conn = self._checkout(wait=False)
+        if conn is None:
+            if self._pinned() is not None or self._iter_conn() is not None:
+                raise RuntimeError(
+                    "query_iter inside a connection() block or query_iter "
+                    "loop requires a free pooled connection "
+                    "(pass connect and a larger pool_size)")
+            conn = self._checkout()
+        with self._lock:
+            self._iter_conns[id(conn)] = (threading.get_ident(), conn)
+        try:
+            cursor = self._server_cursor(conn)
+            if hasattr(cursor, "itersize"):
+                cursor.itersize = chunksize
+            try:
+                cursor.execute(sql_query)
+                columns = None
+                while True:
+                    rows = cursor.fetchmany(chunksize)
+                    if columns is None:
+                        # named cursors describe after first fetch
+                        columns = [col[0] for col in cursor.description]
+                    if not rows:
+                        break
+                    yield pd.DataFrame.from_records(rows, columns=columns)
+            finally:
+                cursor.close()
+        finally:
+            with self._lock:
+                del self._iter_conns[id(conn)]
+            self._idle.put(conn)
+
+    def query_many(
+            self, sql_queries: Iterable[str],
+            max_workers: int = None) -> List[pd.DataFrame]:
+        """Execute independent SQL Queries in parallel
+
+        Each query runs on its own pooled connection; results are
+        returned in the order of sql_queries. Defaults to pool_size
+        workers (queries run serially without a connect factory).
+        Inside a connection() block or a query_iter loop, queries run
+        serially on the caller's connection (or the pool).
+        """
+        if self._pinned() is not None or self._iter_conn() is not None:
+            # pooled connections may all be taken (e.g. pool_size=1),
+            # and the caller's temporary tables live on its connection
+            return [self.query(sql_query) for sql_query in sql_queries]
+        if max_workers is None:
+            max_workers = self.pool_size
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(self.query, sql_queries))
+
+    def execute(
+            self, sql_query: str, params: Iterable = None,
+            prepare: bool = None):
+        """Execute SQL statement without result (see query for params)"""
+        with self.connection() as conn:
+            if params is None:
+                cursor = conn.cursor()
+                cursor.execute(sql_query)
+            else:
+                cursor = self._execute_params(
+                    conn, sql_query, params,
+                    True if prepare is None else prepare)
+            cursor.close()
+
+    def supports_copy(self) -> bool:
+        """Check if connection supports COPY FROM STDIN
+        (psycopg2 or psycopg 3)"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            supported = hasattr(cursor, "copy_expert") or hasattr(cursor, "copy")
+            cursor.close()
+        return supported
+
+    def copy_csv(self, table: str, columns: List[str], buffer: io.StringIO):
+        """Stream CSV rows from buffer into table (COPY FROM STDIN)"""
+        sql_query = (
+            f"COPY {table} ({', '.join(columns)}) "
+            f"FROM STDIN WITH (FORMAT csv)")
+        buffer.seek(0)
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            if hasattr(cursor, "copy_expert"):
+                # psycopg2
+                cursor.copy_expert(sql_query, buffer)
+            else:
+                # psycopg 3
+                with cursor.copy(sql_query) as copy:
+                    copy.write(buffer.getvalue())
+            cursor.close()
+
+    def rollback(self):
+        with self.connection() as conn:
+            conn.rollback()
 
-def classify_data(values: np.ndarray, scheme: str):
+    def close(self):
+        """Close all pooled connections"""
+        with self._lock:
+            connections = [conn for conn in self._connections if conn is not None]
+            self._connections = []
+            self._prepared = {}
+        for conn in connections:
+            conn.close()
+
+CLASSIFY_K = 7
+CLASSIFY_SAMPLE_SIZE = 100000
+CLASSIFY_SEED = 42
+CLASSIFY_CACHE_SIZE = 128
+# memoised breaks: {(array hash, scheme, k, sample_size, seed, stratified): breaks}
+_CLASS_BREAKS: Dict[Tuple, np.ndarray] = {}
+
+def _scheme_kwargs(scheme: str, k: int) -> Dict[str, int]:
+    """Some classification schemes (e.g. HeadTailBreaks)
+    do not support specifying the number of classes"""
+    if scheme == "HeadTailBreaks":
+        return {}
+    return {"k": k}
+
+def array_hash(values: np.ndarray) -> str:
+    """Return content hash of array (dtype, shape and data)"""
+    values = np.ascontiguousarray(values)
+    sha = hashlib.sha1(f"{values.dtype}{values.shape}".encode())
+    sha.update(values.view(np.uint8).reshape(-1))
+    return sha.hexdigest()
+
+def sample_values(
+        values: np.ndarray, sample_size: int = None, seed: int = None,
+        stratified: bool = False) -> np.ndarray:
+    """Return a reproducible sample of (finite) values
+
+    Random samples draw sample_size values without replacement (seeded);
+    stratified samples take evenly spaced quantiles of the sorted values.
+    Both include minimum and maximum, so that breaks cover all values.
+    """
+    if sample_size is None:
+        sample_size = CLASSIFY_SAMPLE_SIZE
+    if seed is None:
+        seed = CLASSIFY_SEED
+    values = np.asarray(values).ravel()
+    values = values[np.isfinite(values)]
+    if len(values) <= sample_size:
+        return values
+    if stratified:
+        return np.quantile(
+            values, np.linspace(0, 1, sample_size), method="inverted_cdf")
+    rng = np.random.default_rng(seed)
+    sample = values[rng.choice(len(values), size=sample_size, replace=False)]
+    sample[:2] = values.min(), values.max()
+    return sample
+
+def classify_breaks(
+        values: np.ndarray, schemes: Union[str, List[str]], k: int = None,
+        sample_size: int = None, seed: int = None,
+        stratified: bool = False) -> Union[np.ndarray, Dict[str, np.ndarray]]:
+    """Return class breaks (upper bounds) for one or several schemes
+
+    Breaks are computed on a sample of values (see sample_values); the
+    array is hashed and sampled once for all schemes, results are
+    memoised per (array hash, scheme, k, sample). Use sample_size=0
+    for breaks on all values.
+
+    Returns breaks for a single scheme, or a dict of breaks per scheme.
+    """
+    if k is None:
+        k = CLASSIFY_K
+    if sample_size is None:
+        sample_size = CLASSIFY_SAMPLE_SIZE
+    if seed is None:
+        seed = CLASSIFY_SEED
+    single = isinstance(schemes, str)
+    if single:
+        schemes = [schemes]
+    values = np.asarray(values)
+    values_hash = array_hash(values)
+    sample = None
+    breaks = {}
+    for scheme in schemes:
+        key = (values_hash, scheme, k, sample_size, seed, stratified)
+        if key not in _CLASS_BREAKS:
+            if sample is None:
+                sample = values.ravel()[np.isfinite(values.ravel())]
+                if sample_size:
+                    sample = sample_values(
+                        sample, sample_size, seed=seed, stratified=stratified)
+            bins = mc.classify(
+                y=sample, scheme=scheme, **_scheme_kwargs(scheme, k)).bins
+            if len(_CLASS_BREAKS) >= CLASSIFY_CACHE_SIZE:
+                # drop oldest entry
+                del _CLASS_BREAKS[next(iter(_CLASS_BREAKS))]
+            _CLASS_BREAKS[key] = np.asarray(bins, dtype=np.float64)
+        breaks[scheme] = _CLASS_BREAKS[key]
+    if single:
+        return breaks[schemes[0]]
+    return breaks
+
+def assign_classes(values: np.ndarray, breaks: np.ndarray) -> np.ndarray:
+    """Assign class index to values, given class breaks (upper bounds,
+    inclusive as in mapclassify); values above the last break are
+    assigned to the last class"""
+    classes = np.searchsorted(breaks, values, side="left")
+    return np.minimum(classes, len(breaks) - 1)
+
+def gvf(values: np.ndarray, classes: np.ndarray) -> float:
+    """Goodness of variance fit of classes (1 - SDCM / SDAM)"""
+    values = np.asarray(values, dtype=np.float64).ravel()
+    classes = np.asarray(classes).ravel()
+    sdam = ((values - values.mean()) ** 2).sum()
+    if sdam == 0:
+        return 1.0
+    counts = np.bincount(classes)
+    sums = np.bincount(classes, weights=values)
+    sums_sq = np.bincount(classes, weights=values ** 2)
+    used = counts > 0
+    sdcm = (sums_sq[used] - sums[used] ** 2 / counts[used]).sum()
+    return 1 - sdcm / sdam
+
+def classify_benchmark(
+        values: np.ndarray, schemes: List[str], k: int = None,
+        sample_sizes: List[int] = None, stratified: bool = False) -> pd.DataFrame:
+    """Compare exact (sample_size 0) and sampled breaks per scheme:
+    time to compute breaks, goodness of variance fit (GVF) on all values
+    and largest break deviation from the exact breaks"""
+    if sample_sizes is None:
+        sample_sizes = [0, CLASSIFY_SAMPLE_SIZE]
+    values = np.asarray(values).ravel()
+    values = values[np.isfinite(values)]
+    rows = []
+    for scheme in schemes:
+        exact = None
+        for sample_size in sample_sizes:
+            start_time = time.perf_counter()
+            breaks = classify_breaks(
+                values, scheme, k=k, sample_size=sample_size,
+                stratified=stratified)
+            seconds = time.perf_counter() - start_time
+            if sample_size == 0:
+                exact = breaks
+            deviation = np.nan
+            if exact is not None and len(exact) == len(breaks):
+                deviation = np.abs(exact - breaks).max()
+            rows.append((
+                scheme, sample_size or len(values), seconds,
+                gvf(values, assign_classes(values, breaks)), deviation))
+    return pd.DataFrame(
+        rows, columns=[
+            "scheme", "sample_size", "seconds", "gvf", "max_break_deviation"])
+
+CLASS_NODATA = 255
+ClassifiedData = namedtuple('Classified_data', 'classes, bounds, cmap')
+
+def classify_mask(
+        values: np.ndarray, nodata: float = None,
+        mask_nonsignificant: bool = None, significant: np.ndarray = None,
+        mask_negative: bool = None, mask_positive: bool = None) -> np.ndarray:
+    """Return boolean array of values to classify: not masked (numpy
+    masked arrays, e.g. from rasterio.mask(.., filled=False)), finite,
+    not nodata and not excluded by the mask_* options"""
+    data = np.ma.getdata(values)
+    valid = ~np.ma.getmaskarray(values)
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= np.isfinite(data)
+    if nodata is not None:
+        valid &= data != nodata
+    if mask_nonsignificant:
+        if significant is None:
+            raise ValueError(
+                "mask_nonsignificant requires a boolean significant array")
+        significant = np.asarray(significant, dtype=bool)
+        if significant.shape != data.shape:
+            raise ValueError(
+                f"significant has shape {significant.shape}, "
+                f"values have shape {data.shape}")
+        valid &= significant
+    if mask_negative:
+        valid &= data > 0
+    if mask_positive:
+        valid &= data < 0
+    return valid
+
+def classify_data(
+        values: np.ndarray, scheme: str, k: int = None,
+        sample_size: int = None, seed: int = None, nodata: float = None,
+        mask_nonsignificant: bool = None, significant: np.ndarray = None,
+        mask_negative: bool = None, mask_positive: bool = None,
+        cmap_name: str = None, return_cmap: bool = None,
+        store_classes: bool = None):
     """Classify data (value series) and return classes,
        bounds, and colormap
        
     Args:
-        grid: A geopandas geodataframe with metric column to classify
-        metric: The metric column to classify values
+        values: Values to classify, e.g. a (masked) raster array.
         scheme: The classification scheme to use.
+        k: Number of classes (default: CLASSIFY_K).
+        sample_size: If set, breaks are computed on a (seeded) sample
+            of sample_size values and applied to all values, see
+            classify_breaks. Recommended for large rasters with
+            super-linear schemes (e.g. FisherJenks).
+        seed: Random seed for sampling.
+        nodata: Value of cells without data (in addition to masked
+            and NaN cells), e.g. the nodata value of a raster.
         mask_nonsignificant: If True, removes non-significant values
             before classifying
+        significant: Boolean array (same shape as values), True for
+            significant values; required for mask_nonsignificant.
         mask_negative: Only consider positive values.
         mask_positive: Only consider negative values.
         cmap_name: The colormap to use.
         return_cmap: if False, returns list instead of mpl.ListedColormap
-        store_classes: Update classes in original grid (_cat column). If
-            not set, no modifications will be made to grid.
+        store_classes: Return classes as uint8 array (same shape
+            as values), CLASS_NODATA for masked values.
+
+    Returns the fitted mapclassify classifier, or with store_classes
+    or cmap_name a Classified_data tuple (classes, bounds, cmap). The
+    classes raster keeps the shape (and transform) of the input and
+    can be written with rasterio (nodata=CLASS_NODATA) or plotted
+    with np.ma.masked_equal(classes, CLASS_NODATA).
         
     Adapted from:
         https://stackoverflow.com/a/58160985/4556479
@@ -92,12 +734,46 @@ def classify_data(values: np.ndarray, scheme: str):
         do not support specifying the number of classes returned
         construct optional kwargs with k == number of classes
     """
-    optional_kwargs = {"k":7}
-    if scheme == "HeadTailBreaks":
-        optional_kwargs = {}
-    scheme_breaks = mc.classify(
-        y=values, scheme=scheme, **optional_kwargs)
-    return scheme_breaks
+    if k is None:
+        k = CLASSIFY_K
+    if return_cmap is None:
+        return_cmap = True
+    valid = classify_mask(
+        values, nodata=nodata, mask_nonsignificant=mask_nonsignificant,
+        significant=significant, mask_negative=mask_negative,
+        mask_positive=mask_positive)
+    data = np.ma.getdata(values)
+    # boolean indexing copies the valid values (one 1-d array);
+    # without invalid cells, ravel is a view of contiguous input
+    valid_values = data[valid] if not valid.all() else data.ravel()
+    legacy = not store_classes and cmap_name is None
+    if sample_size:
+        bounds = classify_breaks(
+            valid_values, scheme, k=k, sample_size=sample_size, seed=seed)
+        if legacy:
+            return mc.UserDefined(valid_values, bins=bounds.tolist())
+    else:
+        scheme_breaks = mc.classify(
+            y=valid_values, scheme=scheme, **_scheme_kwargs(scheme, k))
+        if legacy:
+            return scheme_breaks
+        bounds = np.asarray(scheme_breaks.bins)
+    if len(bounds) >= CLASS_NODATA:
+        raise ValueError(f"Too many classes for uint8: {len(bounds)}")
+    classes = None
+    if store_classes:
+        classes = np.full(data.shape, CLASS_NODATA, dtype=np.uint8)
+        classes[valid] = assign_classes(valid_values, bounds)
+    cmap = None
+    if cmap_name is not None:
+        colors = plt.colormaps[cmap_name].resampled(len(bounds))
+        cmap_list = [
+            mpl_colors.to_hex(color)
+            for color in colors(np.arange(len(bounds)))]
+        cmap = cmap_list
+        if return_cmap:
+            cmap = mpl_colors.ListedColormap(cmap_list)
+    return ClassifiedData(classes, bounds, cmap)
 
 def display_file(file_path: Path, formatting: str = 'Python', summary_txt: str = 'Have a look at '):
     """Load a file and display as Markdown formatted details-summary code-block"""
@@ -118,9 +794,43 @@ def print_link(url: str, hashtag: str):
 
 FileStat = namedtuple('File_stat', 'name, size, records')
 
+LINE_COUNT_BLOCK_SIZE = 16 * 1024 * 1024
+# line counts by (path, mtime, size), see count_lines
+_LINE_COUNTS: Dict[Tuple[str, int, int], int] = {}
+
+def count_lines(file: Path, block_size: int = None) -> int:
+    """Count lines of a text file, reading large binary blocks
+
+    Same count as iterating lines in text mode (a last line without
+    trailing newline is counted). Results are cached by
+    (path, mtime, size), unchanged files are not read again.
+    """
+    if block_size is None:
+        block_size = LINE_COUNT_BLOCK_SIZE
+    file = Path(file)
+    stat = file.stat()
+    key = (str(file.resolve()), stat.st_mtime_ns, stat.st_size)
+    num_lines = _LINE_COUNTS.get(key)
+    if num_lines is not None:
+        return num_lines
+    buffer = bytearray(block_size)
+    num_lines = 0
+    last_byte = b"\n"
+    with open(file, 'rb', buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            num_lines += buffer.count(b"\n", 0, size)
+            last_byte = buffer[size - 1:size]
+    if last_byte != b"\n":
+        num_lines += 1
+    _LINE_COUNTS[key] = num_lines
+    return num_lines
+
 def get_file_stats(name: str, file: Path) -> Tuple[str, str, str]:
     """Get number of records and size of CSV file"""
-    num_lines = f'{sum(1 for line in open(file)):,}'
+    num_lines = f'{count_lines(file):,}'
     size = file.stat().st_size
     size_gb = size/(1024*1024*1024)
     size_format = f'{size_gb:.2f} GB'
@@ -133,12 +843,17 @@ def get_file_stats(name: str, file: Path) -> Tuple[str, str, str]:
         size_format = f'{size_kb:.2f} KB'
     return FileStat(name, size_format, num_lines)
 
-def display_file_stats(filelist: Dict[str, Path]):
-    """Display CSV """
-    df = pd.DataFrame(
-        data=[
-            get_file_stats(name, file) for name, file in filelist.items() if file.exists()
-            ]).transpose()
+def display_file_stats(filelist: Dict[str, Path], max_workers: int = None):
+    """Display CSV 
+
+    max_workers: If > 1, files are counted in parallel threads.
+    """
+    if max_workers is None:
+        max_workers = 1
+    files = [(name, file) for name, file in filelist.items() if file.exists()]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        stats = list(executor.map(lambda item: get_file_stats(*item), files))
+    df = pd.DataFrame(data=stats).transpose()
     header = df.iloc[0]
     df = df[1:]
     df.columns = header
@@ -180,7 +895,10 @@ def return_total(headers: Dict[str, str]):
     return total_length
     
 def stream_progress(total_length: int, loaded: int):
-    """Stream progress report"""
+    """Stream progress report (MB)
+
+    Unthrottled; tools helpers report through Progress instead.
+    """
     clear_output(wait=True)            
     perc_str = ""
     if total_length:
@@ -192,7 +910,10 @@ def stream_progress(total_length: int, loaded: int):
         f"{perc_str}..")
 
 def stream_progress_basic(total: int, loaded: int):
-    """Stream progress report"""
+    """Stream progress report (counts)
+
+    Unthrottled; tools helpers report through Progress instead.
+    """
     clear_output(wait=True)            
     perc_str = ""
     if total:
@@ -202,40 +923,1004 @@ def stream_progress_basic(total: int, loaded: int):
         f"Processed {loaded:.0f} "
         f"{perc_str}..")
 
-def get_stream_file(url: str, path: Path):
-    """Download file from url and save to path"""
-    chunk_size = 8192
-    with requests.get(url, stream=True) as r:
+PROGRESS_INTERVAL = 0.25
+PROGRESS_LOG_INTERVAL = 5.0
+
+def in_notebook() -> bool:
+    """Return True if running inside a Jupyter kernel"""
+    shell = get_ipython()
+    return shell is not None and 'IPKernelApp' in shell.config
+
+def format_duration(seconds: float) -> str:
+    """Format seconds as e.g. 1h 02m, 3m 05s or 12s"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+class Progress:
+    """Throttled progress report for loops over data
+
+    Tracks exact counts (e.g. bytes received), throughput and ETA,
+    but renders at most every min_interval seconds (4 Hz by default),
+    so that fast loops are not slowed down by output. In Jupyter,
+    a single display handle is updated in place; in headless runs,
+    a plain log line is printed every PROGRESS_LOG_INTERVAL seconds.
+
+    Can be used as on_progress callback: progress(loaded, total).
+
+    Args:
+        total: Total count, if known.
+        label: Leading verb, e.g. "Loaded" or "Processed".
+        unit: Unit label, e.g. "MB" or "files".
+        scale: Divisor from counts to unit (1000000 for bytes to MB).
+        backend: "display", "log" or "none". Detected, if not set.
+        initial: Count already done at start (e.g. resumed bytes),
+            excluded from throughput.
+    """
+    def __init__(
+            self, total: int = None, label: str = None, unit: str = None,
+            scale: float = None, backend: str = None,
+            min_interval: float = None, initial: int = None):
+        if label is None:
+            label = "Loaded"
+        if unit is None:
+            unit = "MB"
+        if scale is None:
+            scale = 1000000
+        if backend is None:
+            backend = "display" if in_notebook() else "log"
+        if min_interval is None:
+            min_interval = PROGRESS_INTERVAL
+            if backend == "log":
+                min_interval = PROGRESS_LOG_INTERVAL
+        if initial is None:
+            initial = 0
+        self.total = total
+        self.label = label
+        self.unit = unit
+        self.scale = scale
+        self.backend = backend
+        self.min_interval = min_interval
+        self.initial = initial
+        self.loaded = initial
+        self.postfix = ""
+        self.start_time = time.perf_counter()
+        self._last_render = self.start_time
+        self._handle = None
+
+    def __call__(self, loaded: int, total: int = None):
+        """Set absolute count (and total)"""
+        self.loaded = loaded
+        if total:
+            self.total = total
+        self._throttled_render()
+
+    def add(self, count: int):
+        """Increase count"""
+        self.loaded += count
+        self._throttled_render()
+
+    def _throttled_render(self):
+        now = time.perf_counter()
+        if now - self._last_render < self.min_interval:
+            return
+        self._last_render = now
+        self.render()
+
+    def _value(self, value: float) -> str:
+        if self.scale == 1:
+            return f"{value:,.0f}"
+        return f"{value/self.scale:,.2f}"
+
+    def rate(self) -> float:
+        """Return throughput in counts per second"""
+        elapsed = time.perf_counter() - self.start_time
+        if not elapsed:
+            return 0.0
+        return (self.loaded - self.initial) / elapsed
+
+    def format(self) -> str:
+        """Return progress line"""
+        text = f"{self.label} {self._value(self.loaded)}"
+        if self.total:
+            perc = self.loaded/(self.total/100)
+            text += f" of {self._value(self.total)} {self.unit} ({perc:.0f}%)"
+        else:
+            text += f" {self.unit}"
+        rate = self.rate()
+        if rate:
+            text += f", {self._value(rate)} {self.unit}/s"
+            if self.total and self.total > self.loaded:
+                text += f", ETA {format_duration((self.total - self.loaded) / rate)}"
+        if self.postfix:
+            text += f" - {self.postfix}"
+        return f"{text}.."
+
+    def render(self):
+        """Render current state (unthrottled)"""
+        if self.backend == "none":
+            return
+        text = self.format()
+        if self.backend == "log":
+            print(text, flush=True)
+            return
+        if self._handle is None:
+            self._handle = display(Pretty(text), display_id=True)
+        else:
+            self._handle.update(Pretty(text))
+
+    def close(self):
+        """Render final state"""
+        self.render()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+CHUNK_SIZE = 64 * 1024
+RANGE_PART_SIZE = 16 * 1024 * 1024
+RANGE_WORKERS = 8
+
+_SESSION = None
+
+def get_session(pool_size: int = None) -> requests.Session:
+    """Return a shared requests.Session with a pool of keep-alive connections
+
+    The session is created once per kernel and reused by all download
+    helpers, so that parallel range requests to the same host do not
+    pay for a new TCP/TLS handshake each time.
+    """
+    global _SESSION
+    if _SESSION is None:
+        if pool_size is None:
+            pool_size = RANGE_WORKERS * 2
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=3)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _SESSION = session
+    return _SESSION
+
+RangeProbe = namedtuple('Range_probe', 'total_length, accept_ranges, validator')
+
+def probe_ranges(url: str, session: requests.Session = None) -> RangeProbe:
+    """Check whether url can be fetched in byte ranges
+
+    Requests the first byte only; servers that support ranges
+    answer with 206 and a Content-Range header carrying the total size.
+    Returns total length (or None), range support and the ETag
+    (or Last-Modified) validator used to detect changed files on resume.
+    """
+    if session is None:
+        session = get_session()
+    with session.get(url, stream=True, headers={"Range": "bytes=0-0"}) as r:
         r.raise_for_status()
-        total_length = return_total(r.headers)
-        with open(path, 'wb') as f:
-            for ix, chunk in enumerate(r.iter_content(chunk_size=chunk_size)): 
+        validator = r.headers.get("ETag") or r.headers.get("Last-Modified")
+        content_range = r.headers.get("Content-Range", "")
+        if r.status_code == 206 and "/" in content_range:
+            total = content_range.rsplit("/", 1)[-1]
+            if total.isdigit():
+                return RangeProbe(int(total), True, validator)
+        return RangeProbe(return_total(r.headers), False, validator)
+
+def _manifest_path(path: Path) -> Path:
+    """Return sidecar manifest path for a (partial) download"""
+    return path.with_name(f"{path.name}.part.json")
+
+def _read_manifest(path: Path, expected: Dict) -> List[int]:
+    """Return list of completed parts from a sidecar manifest,
+    if it belongs to the same url, size and file version"""
+    manifest_file = _manifest_path(path)
+    if not manifest_file.exists() or not path.exists():
+        return []
+    try:
+        manifest = json.loads(manifest_file.read_text())
+    except (ValueError, OSError):
+        return []
+    for key, value in expected.items():
+        if manifest.get(key) != value:
+            return []
+    if path.stat().st_size != expected["size"]:
+        return []
+    return manifest.get("done", [])
+
+def _write_manifest(path: Path, manifest: Dict):
+    """Atomically replace sidecar manifest"""
+    manifest_file = _manifest_path(path)
+    tmp_file = manifest_file.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps(manifest))
+    os.replace(tmp_file, manifest_file)
+
+def _fetch_range(
+        session: requests.Session, url: str, path: Path,
+        start: int, end: int, on_chunk, retries: int = 3,
+        slots: threading.Semaphore = None, cancel: threading.Event = None):
+    """Fetch byte range [start, end] of url and write it
+    to the same offset in the preallocated file at path
+
+    slots: Semaphore held while the request is open (connection limit).
+    cancel: Event, raises CancelledError once set.
+    """
+    for attempt in range(retries):
+        written = 0
+        try:
+            with slots if slots is not None else nullcontext(), \
+                    session.get(
+                        url, stream=True,
+                        headers={"Range": f"bytes={start}-{end}"}) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise ValueError(
+                        f"Server ignored range request for {url}")
+                with open(path, "r+b") as f:
+                    f.seek(start)
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if cancel is not None and cancel.is_set():
+                            raise CancelledError(f"Download of {url} cancelled")
+                        f.write(chunk)
+                        written += len(chunk)
+                        on_chunk(len(chunk))
+            if written != end - start + 1:
+                raise IOError(
+                    f"Incomplete range {start}-{end}: {written} bytes")
+            return
+        except (requests.ConnectionError, requests.Timeout, IOError):
+            # discount bytes of the failed attempt, retry the whole part
+            on_chunk(-written)
+            if attempt == retries - 1:
+                raise
+
+def get_stream_file_ranges(
+        url: str, path: Path, total_length: int, validator: str = None,
+        part_size: int = None, max_workers: int = None,
+        session: requests.Session = None,
+        on_progress: Callable[[int, Optional[int]], None] = None,
+        slots: threading.Semaphore = None, cancel: threading.Event = None):
+    """Download url to path in concurrent byte ranges
+
+    The target file is preallocated to total_length and each part is
+    written to its own offset. Completed parts are recorded in a sidecar
+    manifest (<path>.part.json), so that an interrupted transfer resumes
+    with the missing parts only. The manifest is removed on success.
+
+    on_progress: Called with (loaded bytes, total length) instead
+        of printing progress.
+    slots: Semaphore acquired by each part request, e.g. to share
+        a per-host connection limit (see fetch_many_async).
+    cancel: Event to stop the download (raises CancelledError).
+    """
+    if part_size is None:
+        part_size = RANGE_PART_SIZE
+    if max_workers is None:
+        max_workers = RANGE_WORKERS
+    if session is None:
+        session = get_session()
+    manifest = {
+        "url": url, "size": total_length,
+        "validator": validator, "part_size": part_size}
+    parts = [
+        (ix, start, min(start + part_size, total_length) - 1)
+        for ix, start in enumerate(range(0, total_length, part_size))]
+    done = set(_read_manifest(path, manifest))
+    if not done:
+        # preallocate target file
+        with open(path, "wb") as f:
+            f.truncate(total_length)
+    manifest["done"] = sorted(done)
+    _write_manifest(path, manifest)
+    lock = threading.Lock()
+    loaded = sum(
+        end - start + 1 for ix, start, end in parts if ix in done)
+    def on_chunk(size: int):
+        nonlocal loaded
+        with lock:
+            loaded += size
+    progress = on_progress
+    if progress is None:
+        progress = Progress(total=total_length, initial=loaded)
+    pending = [part for part in parts if part[0] not in done]
+    with ThreadPoolExecutor(
+            max_workers=min(max_workers, max(len(pending), 1))) as executor:
+        futures = {
+            executor.submit(
+                _fetch_range, session, url, path, start, end, on_chunk,
+                slots=slots, cancel=cancel): ix
+            for ix, start, end in pending}
+        try:
+            while futures:
+                finished, __ = wait(
+                    futures, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    ix = futures.pop(future)
+                    # raises, if a part failed; the manifest keeps
+                    # all parts finished so far
+                    future.result()
+                    done.add(ix)
+                    manifest["done"] = sorted(done)
+                    _write_manifest(path, manifest)
+                progress(loaded, total_length)
+        except BaseException:
+            # do not start the remaining parts
+            for future in futures:
+                future.cancel()
+            raise
+    if on_progress is None:
+        progress.close()
+    _manifest_path(path).unlink()
+
+def link_or_copy(source: Path, target: Path):
+    """Hard link target to source (no copy), or copy across
+    file systems; an existing target is replaced"""
+    target = Path(target)
+    target.unlink(missing_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def get_stream_file(
+        url: str, path: Path, parallel: bool = None,
+        part_size: int = None, max_workers: int = None,
+        use_cache: bool = None):
+    """Download file from url and save to path
+
+    If the server supports byte ranges (Accept-Ranges), the file
+    is fetched in concurrent parts that can be resumed after an
+    interruption (see get_stream_file_ranges). Otherwise, or with
+    parallel=False, falls back to a single stream.
+
+    With use_cache (default: USE_CACHE), path is a hard link to the
+    file in the shared DownloadCache (revalidated or filled first),
+    or a copy if the cache is on another file system. Replace the
+    file instead of modifying it in place.
+    """
+    if parallel is None:
+        parallel = True
+    if use_cache is None:
+        use_cache = USE_CACHE
+    if use_cache:
+        link_or_copy(download_cache().fetch(url), path)
+        return
+    session = get_session()
+    if parallel:
+        probe = probe_ranges(url, session)
+        if probe.accept_ranges and probe.total_length:
+            get_stream_file_ranges(
+                url, path, total_length=probe.total_length,
+                validator=probe.validator, part_size=part_size,
+                max_workers=max_workers, session=session)
+            return
+    with session.get(url, stream=True) as r:
+        r.raise_for_status()
+        with open(path, 'wb') as f, Progress(
+                total=return_total(r.headers)) as progress:
+            for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
                 f.write(chunk)
-                loaded = (ix*chunk_size)/1000000
-                if (ix % 100 == 0):
-                    stream_progress(
-                        total_length, loaded)
-            stream_progress(
-                total_length, loaded)
-                        
-def get_stream_bytes(url: str):
-    """Stream file from url to bytes object (in-memory)"""
-    chunk_size = 8192
-    content = bytes()
-    with requests.get(url, stream=True) as r:
+                progress.add(len(chunk))
+
+class MemoryReader(io.RawIOBase):
+    """Read-only, seekable file object over a memoryview
+
+    Unlike io.BytesIO(buffer), no copy of the underlying
+    buffer is made; e.g. used to hand a downloaded archive
+    to zipfile.ZipFile.
+    """
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(self._pos + size, end)
+        data = bytes(self._view[self._pos:end])
+        self._pos = max(self._pos, end)
+        return data
+
+    def readinto(self, b) -> int:
+        data = self._view[self._pos:self._pos + len(b)]
+        size = len(data)
+        b[:size] = data
+        self._pos += size
+        return size
+
+def get_stream_view(
+        url: str, report: bool = None, use_cache: bool = None) -> memoryview:
+    """Stream file from url to a memoryview (in-memory, zero-copy)
+
+    The response is read directly into a single preallocated bytearray,
+    sized from Content-Length if the server sends it; further data
+    (no or short Content-Length) is appended, growing the bytearray
+    in place. The returned memoryview covers the received bytes
+    without copying the buffer.
+
+    Args:
+        report: If True (default), print wall time and buffer size.
+        use_cache: If True (default: USE_CACHE), the view maps the
+            file in the shared DownloadCache (revalidated or filled
+            first) read-only into memory (mmap), without a copy.
+    """
+    if report is None:
+        report = True
+    if use_cache is None:
+        use_cache = USE_CACHE
+    start_time = time.perf_counter()
+    if use_cache:
+        cached_file = download_cache().fetch(url)
+        if not cached_file.stat().st_size:
+            # empty files cannot be mapped
+            return memoryview(b"")
+        with open(cached_file, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if report:
+            print(
+                f"Mapped {len(mapped)/1000000:.2f} MB from cache in "
+                f"{time.perf_counter() - start_time:.2f}s")
+        return memoryview(mapped)
+    with get_session().get(url, stream=True) as r:
         r.raise_for_status()
         total_length = return_total(r.headers)
-        for ix, chunk in enumerate(r.iter_content(
-                chunk_size=chunk_size)): 
-            content += bytes(chunk)
-            loaded = (ix*chunk_size)/1000000
-            if (ix % 100 == 0):
-                stream_progress(
-                    total_length, loaded)
-    stream_progress(
-        total_length, loaded)
+        # Content-Length refers to the encoded (e.g. gzip) body,
+        # it is only an initial guess for the buffer size
+        buffer = bytearray(total_length or CHUNK_SIZE * 16)
+        view = memoryview(buffer)
+        r.raw.decode_content = True
+        progress = Progress(total=total_length)
+        loaded = 0
+        scratch = bytearray(CHUNK_SIZE)
+        scratch_view = memoryview(scratch)
+        while True:
+            if loaded < len(buffer):
+                size = r.raw.readinto(view[loaded:loaded + CHUNK_SIZE])
+                if not size:
+                    break
+            else:
+                # buffer full: check for more data first, so that
+                # an exact Content-Length never triggers growth
+                size = r.raw.readinto(scratch)
+                if not size:
+                    break
+                # append in place (amortized by the bytearray
+                # over-allocation), without a zero-filled temporary
+                view.release()
+                buffer += scratch_view[:size]
+                view = memoryview(buffer)
+            loaded += size
+            progress(loaded)
+    progress.close()
+    if report:
+        print(
+            f"Retrieved {loaded/1000000:.2f} MB in "
+            f"{time.perf_counter() - start_time:.2f}s, "
+            f"buffer size: {len(buffer)/1000000:.2f} MB")
+    return view[:loaded]
+
+def get_stream_bytes(
+        url: str, report: bool = None, use_cache: bool = None) -> bytes:
+    """Stream file from url to bytes object (in-memory)
+
+    Returns a copy of the received data; use get_stream_view()
+    to avoid the copy (e.g. for zipfile, see MemoryReader).
+    """
+    view = get_stream_view(url, report=report, use_cache=use_cache)
+    content = view.tobytes()
+    view.release()
     return content
-                        
+
+CACHE_DIR = Path(os.environ.get(
+    "TOOLS_CACHE_DIR",
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "tools"))
+CACHE_MAX_SIZE_MB = float(os.environ.get("TOOLS_CACHE_MAX_MB", 10000))
+# default of use_cache in all download helpers (get_stream_file,
+# get_stream_view/_bytes, get_zip_extract, get_shapes); set
+# TOOLS_USE_CACHE=0 to download directly
+USE_CACHE = os.environ.get(
+    "TOOLS_USE_CACHE", "1").lower() not in ("0", "false", "no")
+
+def file_sha256(path: Path, block_size: int = None) -> str:
+    """Return sha256 hex digest of a file, read block-wise"""
+    if block_size is None:
+        block_size = 1024 * 1024
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+class DownloadCache:
+    """Content-addressed cache for downloads, shared across notebooks
+
+    Files are stored once per content hash (objects/ab/abcdef..)
+    and referenced from an index (index.json) keyed by url, together
+    with the ETag/Last-Modified validators of the response.
+    Cached entries are revalidated with a conditional GET; a 304
+    answer reuses the local copy without transfer. If the server
+    cannot be reached, the cached copy is used as is.
+
+    The total size is bounded by max_size_mb, least recently used
+    entries are evicted first. Point TOOLS_CACHE_DIR to a shared
+    folder to seed new containers from an existing cache.
+    """
+    def __init__(self, cache_dir: Path = None, max_size_mb: float = None):
+        if cache_dir is None:
+            cache_dir = CACHE_DIR
+        if max_size_mb is None:
+            max_size_mb = CACHE_MAX_SIZE_MB
+        self.cache_dir = Path(cache_dir)
+        self.max_size_mb = max_size_mb
+        self.index_file = self.cache_dir / "index.json"
+        # index updates are read-modify-write, guard against
+        # concurrent downloads in threads (see fetch_many) and
+        # other processes sharing cache_dir (see _index_lock)
+        self._lock = threading.RLock()
+        self._lock_file = None
+        (self.cache_dir / "objects").mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / "tmp").mkdir(exist_ok=True)
+
+    @contextmanager
+    def _index_lock(self):
+        """Hold the index for a read-modify-write: across threads
+        (RLock) and processes, e.g. several kernels sharing
+        TOOLS_CACHE_DIR (flock on index.lock); reentrant"""
+        with self._lock:
+            if self._lock_file is not None or fcntl is None:
+                yield
+                return
+            with open(self.cache_dir / "index.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if not self.index_file.exists():
+            return {}
+        try:
+            return json.loads(self.index_file.read_text())
+        except ValueError:
+            return {}
+
+    def _save_index(self, index: Dict[str, Dict]):
+        tmp_file = self.index_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(index, indent=1))
+        os.replace(tmp_file, self.index_file)
+
+    def _blob(self, sha256: str) -> Path:
+        return self.cache_dir / "objects" / sha256[:2] / sha256
+
+    def tmp_path(self, url: str) -> Path:
+        """Return a stable temporary download path for url,
+        so that interrupted range downloads can be resumed"""
+        url_key = hashlib.sha1(url.encode()).hexdigest()
+        return self.cache_dir / "tmp" / f"{url_key}.download"
+
+    def unique_tmp_path(self) -> Path:
+        """Return a new, unique temporary download path"""
+        tmp_fd, tmp_name = tempfile.mkstemp(
+            suffix=".download", dir=self.cache_dir / "tmp")
+        os.close(tmp_fd)
+        return Path(tmp_name)
+
+    def lock_tmp_path(self, url: str) -> Optional[Path]:
+        """Create the lock file of tmp_path(url) exclusively (O_EXCL)
+
+        Returns the lock file, or None if another download (thread
+        or process) of url holds it. Locks of processes that no
+        longer exist are taken over.
+        """
+        lock_file = self.tmp_path(url).with_suffix(".lock")
+        for attempt in range(2):
+            try:
+                lock_fd = os.open(
+                    lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if attempt or not self._stale_lock(lock_file):
+                    return
+                lock_file.unlink(missing_ok=True)
+                continue
+            with os.fdopen(lock_fd, "w") as f:
+                f.write(str(os.getpid()))
+            return lock_file
+
+    @staticmethod
+    def _stale_lock(lock_file: Path) -> bool:
+        try:
+            pid = int(lock_file.read_text())
+        except (OSError, ValueError):
+            # removed meanwhile, or pid not written yet
+            return False
+        if pid == os.getpid():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    def lookup(self, url: str) -> Optional[Path]:
+        """Return cached file for url (without revalidation)"""
+        entry = self._load_index().get(url)
+        if entry is None:
+            return
+        blob = self._blob(entry["sha256"])
+        try:
+            size = blob.stat().st_size
+        except FileNotFoundError:
+            return
+        if size != entry["size"]:
+            # modified in place, e.g. through a hard link
+            return
+        return blob
+
+    def _touch(self, url: str):
+        with self._index_lock():
+            index = self._load_index()
+            if url in index:
+                index[url]["last_access"] = time.time()
+                self._save_index(index)
+
+    def _conditional_headers(self, url: str) -> Dict[str, str]:
+        entry = self._load_index().get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def validate(self, url: str) -> Optional[Path]:
+        """Return cached file for url, if the server confirms
+        it is fresh (304) or cannot be reached; None otherwise"""
+        blob = self.lookup(url)
+        if blob is None:
+            return
+        headers = self._conditional_headers(url)
+        if not headers:
+            return
+        try:
+            with get_session().get(url, stream=True, headers=headers) as r:
+                if r.status_code != 304:
+                    return
+        except requests.ConnectionError:
+            print(f"{url} not reachable, using cached copy..")
+        self._touch(url)
+        return blob
+
+    def fetch(
+            self, url: str,
+            on_progress: Callable[[int, Optional[int]], None] = None,
+            slots: threading.Semaphore = None,
+            cancel: threading.Event = None) -> Path:
+        """Return path of a fresh local copy of url,
+        downloading it only if missing or changed
+
+        on_progress: Called with (loaded bytes, total length) instead
+            of printing progress.
+        slots: Semaphore held for each open request to the host (the
+            initial request, and each part of range downloads).
+        cancel: Event to stop the download (raises CancelledError).
+        """
+        blob = self.lookup(url)
+        headers = {}
+        if blob is not None:
+            headers = self._conditional_headers(url)
+        with ExitStack() as slot:
+            if slots is not None:
+                slot.enter_context(slots)
+            try:
+                r = get_session().get(url, stream=True, headers=headers)
+            except requests.ConnectionError:
+                if blob is None:
+                    raise
+                print(f"{url} not reachable, using cached copy..")
+                self._touch(url)
+                return blob
+            with r:
+                if r.status_code == 304 and blob is not None:
+                    self._touch(url)
+                    return blob
+                r.raise_for_status()
+                total_length = return_total(r.headers)
+                if (r.headers.get("Accept-Ranges") == "bytes"
+                        and total_length and total_length > RANGE_PART_SIZE):
+                    r.close()
+                    # part requests acquire their own slots
+                    slot.close()
+                    return self._fetch_ranges(
+                        url, total_length,
+                        r.headers, on_progress, slots, cancel)
+                tmp_file = self.unique_tmp_path()
+                try:
+                    progress = on_progress
+                    if progress is None:
+                        progress = Progress(total=total_length)
+                    loaded = 0
+                    with open(tmp_file, 'wb') as f:
+                        for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                            if cancel is not None and cancel.is_set():
+                                raise CancelledError(
+                                    f"Download of {url} cancelled")
+                            f.write(chunk)
+                            loaded += len(chunk)
+                            progress(loaded, total_length)
+                    if on_progress is None:
+                        progress.close()
+                    return self.store(url, tmp_file, r.headers)
+                except BaseException:
+                    tmp_file.unlink(missing_ok=True)
+                    raise
+
+    def _fetch_ranges(
+            self, url: str, total_length: int, headers: Dict[str, str],
+            on_progress: Callable[[int, Optional[int]], None] = None,
+            slots: threading.Semaphore = None,
+            cancel: threading.Event = None) -> Path:
+        """Large file: continue with resumable range download,
+        unless url is already being downloaded elsewhere"""
+        lock_file = self.lock_tmp_path(url)
+        tmp_file = self.tmp_path(url) if lock_file \
+            else self.unique_tmp_path()
+        try:
+            get_stream_file_ranges(
+                url, tmp_file, total_length=total_length,
+                validator=headers.get("ETag") or headers.get("Last-Modified"),
+                on_progress=on_progress, slots=slots, cancel=cancel)
+            return self.store(url, tmp_file, headers)
+        except BaseException:
+            if lock_file is None:
+                tmp_file.unlink(missing_ok=True)
+                _manifest_path(tmp_file).unlink(missing_ok=True)
+            raise
+        finally:
+            if lock_file is not None:
+                lock_file.unlink(missing_ok=True)
+
+    def store(self, url: str, file: Path, headers: Dict[str, str] = None) -> Path:
+        """Move a downloaded file into the cache and index it for url"""
+        if headers is None:
+            headers = {}
+        sha256 = file_sha256(file)
+        blob = self._blob(sha256)
+        with self._index_lock():
+            if blob.exists():
+                # same content already cached (e.g. from another url)
+                file.unlink(missing_ok=True)
+            else:
+                blob.parent.mkdir(exist_ok=True)
+                self._move(file, blob)
+            index = self._load_index()
+            index[url] = {
+                "sha256": sha256,
+                "size": blob.stat().st_size,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "last_access": time.time()}
+            self._save_index(index)
+            self.evict(keep=url)
+        return blob
+
+    def _move(self, file: Path, blob: Path):
+        """Atomically move file to blob (via a copy in tmp/,
+        if file is on another file system)"""
+        try:
+            os.replace(file, blob)
+            return
+        except OSError:
+            pass
+        tmp_file = self.unique_tmp_path()
+        try:
+            shutil.copyfile(file, tmp_file)
+            os.replace(tmp_file, blob)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        file.unlink()
+
+    def size_mb(self) -> float:
+        """Return total size of cached files in MegaBytes"""
+        index = self._load_index()
+        sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+        return sum(sizes.values()) / (1024*1024)
+
+    def evict(self, keep: str = None):
+        """Remove least recently used entries until the cache
+        fits into max_size_mb (entry for url keep is retained)"""
+        with self._index_lock():
+            self._evict(keep)
+
+    def _evict(self, keep: str = None):
+        index = self._load_index()
+        sizes = {entry["sha256"]: entry["size"] for entry in index.values()}
+        total_mb = sum(sizes.values()) / (1024*1024)
+        if total_mb <= self.max_size_mb:
+            return
+        for url, entry in sorted(
+                index.items(), key=lambda item: item[1]["last_access"]):
+            if total_mb <= self.max_size_mb:
+                break
+            if url == keep:
+                continue
+            del index[url]
+            sha256 = entry["sha256"]
+            if any(e["sha256"] == sha256 for e in index.values()):
+                # content still referenced from other urls
+                continue
+            blob = self._blob(sha256)
+            if blob.exists():
+                blob.unlink()
+            total_mb -= sizes[sha256] / (1024*1024)
+        self._save_index(index)
+
+    def clear(self):
+        """Remove all cached files"""
+        shutil.rmtree(self.cache_dir)
+        self.__init__(self.cache_dir, self.max_size_mb)
+
+_DOWNLOAD_CACHE = None
+
+def download_cache() -> DownloadCache:
+    """Return shared DownloadCache (located in TOOLS_CACHE_DIR)"""
+    global _DOWNLOAD_CACHE
+    if _DOWNLOAD_CACHE is None:
+        _DOWNLOAD_CACHE = DownloadCache()
+    return _DOWNLOAD_CACHE
+
+QUERY_CACHE_TTL = 24 * 3600
+QUERY_CACHE_MAX_SIZE_MB = 1000
+
+class QueryCache:
+    """On-disk cache for query results (Parquet), see DbConn(cache=..)
+
+    Results are keyed by normalised SQL text, parameters and a version
+    of the source data (e.g. DbConn.table_version). Entries expire
+    after ttl seconds; the total size is bounded by max_size_mb,
+    least recently used entries are evicted first. Cache hits and
+    misses are counted in hits and misses.
+    """
+    def __init__(
+            self, cache_dir: Path = None, ttl: float = None,
+            max_size_mb: float = None):
+        if cache_dir is None:
+            cache_dir = CACHE_DIR / "queries"
+        if ttl is None:
+            ttl = QUERY_CACHE_TTL
+        if max_size_mb is None:
+            max_size_mb = QUERY_CACHE_MAX_SIZE_MB
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_size_mb = max_size_mb
+        self.index_file = self.cache_dir / "index.json"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __repr__(self):
+        return (
+            f"QueryCache({self.cache_dir}, hits={self.hits}, "
+            f"misses={self.misses}, size={self.size_mb():.2f} MB)")
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if not self.index_file.exists():
+            return {}
+        try:
+            return json.loads(self.index_file.read_text())
+        except ValueError:
+            return {}
+
+    def _save_index(self, index: Dict[str, Dict]):
+        tmp_file = self.index_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(index, indent=1))
+        os.replace(tmp_file, self.index_file)
+
+    @staticmethod
+    def key(sql_query: str, params: Iterable = None, version: str = None) -> str:
+        """Return cache key for normalised sql_query, params and version"""
+        sql_norm = " ".join(sql_query.split()).rstrip(";").strip()
+        if params is not None:
+            params = [
+                param.tolist() if isinstance(param, np.ndarray) else param
+                for param in params]
+        payload = json.dumps([sql_norm, params, version], default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _file(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.parquet"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """Return cached result for key, or None if missing or expired"""
+        with self._lock:
+            index = self._load_index()
+            entry = index.get(key)
+            if entry is not None and time.time() - entry["created"] > self.ttl:
+                del index[key]
+                self._file(key).unlink(missing_ok=True)
+                self._save_index(index)
+                entry = None
+            if entry is None or not self._file(key).exists():
+                self.misses += 1
+                return
+            entry["last_access"] = time.time()
+            self._save_index(index)
+        self.hits += 1
+        return pd.read_parquet(self._file(key))
+
+    def put(self, key: str, df: pd.DataFrame, sql_query: str = None):
+        """Store query result df for key"""
+        file = self._file(key)
+        tmp_file = file.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            df.to_parquet(tmp_file)
+        except (ImportError, ValueError, TypeError) as e:
+            # no Parquet engine, or columns not serializable
+            tmp_file.unlink(missing_ok=True)
+            warnings.warn(f"Query result not cached: {e}")
+            return
+        os.replace(tmp_file, file)
+        with self._lock:
+            index = self._load_index()
+            now = time.time()
+            index[key] = {
+                "created": now,
+                "last_access": now,
+                "size": file.stat().st_size,
+                "sql": None if sql_query is None else sql_query.strip()[:200]}
+            self._save_index(index)
+            self._evict(index, keep=key)
+
+    def size_mb(self) -> float:
+        """Return total size of cached results in MegaBytes"""
+        index = self._load_index()
+        return sum(entry["size"] for entry in index.values()) / (1024*1024)
+
+    def _evict(self, index: Dict[str, Dict], keep: str = None):
+        total_mb = sum(entry["size"] for entry in index.values()) / (1024*1024)
+        if total_mb <= self.max_size_mb:
+            return
+        for key, entry in sorted(
+                index.items(), key=lambda item: item[1]["last_access"]):
+            if total_mb <= self.max_size_mb:
+                break
+            if key == keep:
+                continue
+            del index[key]
+            self._file(key).unlink(missing_ok=True)
+            total_mb -= entry["size"] / (1024*1024)
+        self._save_index(index)
+
+    def clear(self):
+        """Remove all cached results and reset counters"""
+        shutil.rmtree(self.cache_dir)
+        self.__init__(self.cache_dir, self.ttl, self.max_size_mb)
+
 def highlight_row(s, color):
     return f'background-color: {color}'
 
@@ -265,25 +1950,365 @@ def display_header_stats(
     styler.set_table_styles(css)
     display(styler)
 
-def get_folder_size(folder: Path):
-    """Return size of all files in folder in MegaBytes"""
+def ignore_pattern(
+        names: Iterable[str] = None,
+        patterns: Iterable[str] = None) -> Optional[re.Pattern]:
+    """Compile file/folder names and fnmatch patterns (e.g. "*.pyc")
+    into a single regex, matched against entry names"""
+    parts = [f"{re.escape(name)}\\Z" for name in names or []]
+    parts += [fnmatch.translate(pattern) for pattern in patterns or []]
+    if not parts:
+        return
+    return re.compile("|".join(f"(?:{part})" for part in parts))
+
+def scan_folder(
+        folder: Path, ignore: re.Pattern = None,
+        follow_symlinks: bool = True) -> Tuple[List[os.DirEntry], List[os.DirEntry]]:
+    """Return (directories, files) entries of folder (os.scandir),
+    skipping names matching ignore (see ignore_pattern)"""
+    dirs = []
+    files = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if ignore is not None and ignore.match(entry.name):
+                    continue
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    dirs.append(entry)
+                else:
+                    files.append(entry)
+    except (PermissionError, FileNotFoundError):
+        pass
+    return dirs, files
+
+def walk_folder(
+        folder: Path, ignore: re.Pattern = None) -> Iterator[
+            Tuple[str, List[os.DirEntry], List[os.DirEntry]]]:
+    """Walk folder top-down, yield (path, directories, files) entries
+    per folder; symlinked folders are not followed"""
+    stack = [os.fspath(folder)]
+    while stack:
+        path = stack.pop()
+        dirs, files = scan_folder(path, ignore, follow_symlinks=False)
+        yield path, dirs, files
+        stack.extend(entry.path for entry in reversed(dirs))
+
+def _folder_size(folder: Path, ignore: re.Pattern = None) -> Tuple[int, int]:
+    """Return total size (bytes) and number of files below folder"""
+    size = 0
+    num_files = 0
+    for __, __, files in walk_folder(folder, ignore):
+        for entry in files:
+            try:
+                size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+            num_files += 1
+    return size, num_files
+
+def folder_sizes(
+        folder: Path, ignore_files_folders: Iterable[str] = None,
+        ignore_match: Iterable[str] = None,
+        max_workers: int = None) -> pd.DataFrame:
+    """Return size breakdown per subfolder of folder (recursive)
+
+    Returns a DataFrame indexed by subfolder name, with size_bytes,
+    size_mb and files; files directly in folder are listed as ".".
+    max_workers: If > 1, subfolders are scanned in parallel threads.
+    """
+    if max_workers is None:
+        max_workers = 1
+    ignore = ignore_pattern(ignore_files_folders, ignore_match)
+    dirs, files = scan_folder(folder, ignore, follow_symlinks=False)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sizes = list(executor.map(
+            lambda entry: _folder_size(entry.path, ignore), dirs))
+    top_size = sum(entry.stat(follow_symlinks=False).st_size for entry in files)
+    df = pd.DataFrame(
+        [(entry.name, *size) for entry, size in zip(dirs, sizes)]
+        + [(".", top_size, len(files))],
+        columns=["folder", "size_bytes", "files"]).set_index("folder")
+    df.insert(1, "size_mb", df["size_bytes"] / (1024*1024))
+    return df.sort_values("size_bytes", ascending=False)
+
+def get_folder_size(folder: Path, recursive: bool = None):
+    """Return size of all files in folder in MegaBytes
+
+    recursive: Include files in subfolders (default: False, files
+        directly in folder only). See folder_sizes for a breakdown
+        per subfolder.
+    """
+    if recursive is None:
+        recursive = False
     if not folder.exists():
         raise Warning(
             f"Folder {folder} does not exist")
         return
-    size_mb = 0
-    for file in folder.glob('*'):
-        size_mb += file.stat().st_size / (1024*1024)
-    return size_mb
+    if recursive:
+        size, __ = _folder_size(folder)
+        return size / (1024*1024)
+    # all entries of folder (subfolder entries included), as before
+    dirs, files = scan_folder(folder)
+    return sum(
+        entry.stat().st_size for entry in dirs + files) / (1024*1024)
+
+class SpoolDownload:
+    """Download url in a background thread to a spool file and
+    let readers consume the bytes as soon as they have arrived
+
+    read() blocks until the requested bytes are on disk (or
+    the download has finished), so that sequential consumers,
+    such as stream_zip_extract, can start before the transfer ends.
+    cancel() stops the transfer after the current chunk.
+    """
+    def __init__(self, url: str, spool_file: Path):
+        self.url = url
+        self.spool_file = spool_file
+        self.total_length = None
+        self.headers = {}
+        self.written = 0
+        self.done = False
+        self.error = None
+        self._pos = 0
+        self._cond = threading.Condition()
+        self._cancel = threading.Event()
+        self._reader = None
+        self._thread = threading.Thread(target=self._download, daemon=True)
+        self._thread.start()
+
+    def _download(self):
+        try:
+            with get_session().get(self.url, stream=True) as r:
+                r.raise_for_status()
+                self.headers = r.headers
+                self.total_length = return_total(r.headers)
+                with open(self.spool_file, 'wb') as f:
+                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
+                        if self._cancel.is_set():
+                            break
+                        f.write(chunk)
+                        f.flush()
+                        with self._cond:
+                            self.written += len(chunk)
+                            self._cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def _wait_for(self, end: int):
+        """Block until end bytes are available or download has finished"""
+        with self._cond:
+            while self.written < end and not self.done:
+                self._cond.wait()
+        if self.error:
+            raise self.error
+
+    def wait(self):
+        """Block until the download has finished"""
+        self._wait_for(float("inf"))
+
+    def cancel(self):
+        """Stop the download (checked after each received chunk)"""
+        self._cancel.set()
+
+    def join(self):
+        """Block until the download thread has ended, without
+        raising download errors (see wait())"""
+        self._thread.join()
+
+    def read(self, size: int) -> bytes:
+        """Read exactly size bytes from the current position"""
+        self._wait_for(self._pos + size)
+        if self._reader is None:
+            self._reader = open(self.spool_file, 'rb')
+        self._reader.seek(self._pos)
+        data = self._reader.read(size)
+        if len(data) < size:
+            raise EOFError(
+                f"Unexpected end of data in {self.url}")
+        self._pos += size
+        return data
+
+    def skip(self, size: int):
+        """Move read position without reading (or waiting)"""
+        self._pos += size
+
+    def close(self):
+        if self._reader is not None:
+            self._reader.close()
+
+ZIP_LOCAL_HEADER = b"PK\x03\x04"
+ZIP_LOCAL_STRUCT = struct.Struct("<HHHHHIIIHH")
+ZIP_STREAM_METHODS = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+
+def _zip_member_path(output_path: Path, name: str) -> Path:
+    """Sanitize zip member name to a path below output_path
+    (strips drive letters, absolute paths and '..', as zipfile does)"""
+    parts = [
+        part for part in name.replace('\\', '/').split('/')
+        if part not in ('', '.', '..')]
+    if parts:
+        parts[0] = os.path.splitdrive(parts[0])[1] or parts[0]
+    return output_path.joinpath(*parts)
+
+def _zip64_sizes(extra: bytes, csize: int, usize: int) -> Tuple[int, int]:
+    """Read 64-bit sizes from the Zip64 extra field of a local header"""
+    pos = 0
+    while pos + 4 <= len(extra):
+        header_id, length = struct.unpack("<HH", extra[pos:pos + 4])
+        if header_id == 0x0001:
+            data = extra[pos + 4:pos + 4 + length]
+            values = iter(struct.unpack(f"<{len(data) // 8}Q", data[:len(data) // 8 * 8]))
+            if usize == 0xFFFFFFFF:
+                usize = next(values)
+            if csize == 0xFFFFFFFF:
+                csize = next(values)
+            break
+        pos += 4 + length
+    return csize, usize
+
+def stream_zip_extract(
+        url: str, output_path: Path, filter_files: List[str] = None,
+        spool_dir: Path = None, report: bool = True,
+        cache: DownloadCache = None) -> List[str]:
+    """Extract zip members from url while the archive is still downloading
+
+    The archive is spooled to a temporary file by a background
+    thread. The local file headers are read sequentially as the bytes
+    arrive, and each finished member is written to output_path
+    immediately. Members not in filter_files are skipped by their
+    compressed size, without inflating them.
+
+    If a member cannot be streamed (sizes only in a trailing data
+    descriptor, encryption, compression other than stored/deflate),
+    the remaining members are extracted with zipfile from the central
+    directory, once the download has finished.
+
+    If cache is given, the spooled archive is stored in the
+    DownloadCache after a successful extraction.
+
+    Returns the names of the extracted members.
+    """
+    if spool_dir is None:
+        spool_dir = output_path
+        if cache is not None:
+            spool_dir = cache.cache_dir / "tmp"
+    spool_fd, spool_name = tempfile.mkstemp(suffix=".zip.part", dir=spool_dir)
+    os.close(spool_fd)
+    spool_file = Path(spool_name)
+    spool = SpoolDownload(url, spool_file)
+    progress = Progress(backend=None if report else "none")
+    extracted = []
+    seen = set()
+    try:
+        while True:
+            if spool.read(4) != ZIP_LOCAL_HEADER:
+                # reached central directory
+                break
+            (__, flag, method, __, __, crc, csize, usize,
+             name_len, extra_len) = ZIP_LOCAL_STRUCT.unpack(
+                spool.read(ZIP_LOCAL_STRUCT.size))
+            name = spool.read(name_len).decode(
+                'utf-8' if flag & 0x800 else 'cp437')
+            extra = spool.read(extra_len)
+            if 0xFFFFFFFF in (csize, usize):
+                csize, usize = _zip64_sizes(extra, csize, usize)
+            if flag & 0x01 or flag & 0x08 or method not in ZIP_STREAM_METHODS:
+                # sizes unknown up front or not streamable,
+                # continue from the central directory
+                break
+            seen.add(name)
+            if filter_files and name not in filter_files:
+                spool.skip(csize)
+                continue
+            target = _zip_member_path(output_path, name)
+            if name.endswith('/'):
+                target.mkdir(parents=True, exist_ok=True)
+                spool.skip(csize)
+                continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            inflater = zlib.decompressobj(-15) if method == zipfile.ZIP_DEFLATED else None
+            checksum = 0
+            remaining = csize
+            with open(target, 'wb') as f:
+                while remaining:
+                    data = spool.read(min(remaining, CHUNK_SIZE))
+                    remaining -= len(data)
+                    if inflater:
+                        data = inflater.decompress(data)
+                    checksum = zlib.crc32(data, checksum)
+                    f.write(data)
+                    progress(spool.written, spool.total_length)
+                if inflater:
+                    data = inflater.flush()
+                    checksum = zlib.crc32(data, checksum)
+                    f.write(data)
+            if checksum != crc:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {name}")
+            extracted.append(name)
+            progress.postfix = f"{len(extracted)} files extracted"
+            progress(spool.written, spool.total_length)
+        spool.wait()
+        with zipfile.ZipFile(spool_file) as z:
+            for name in z.namelist():
+                if name in seen:
+                    continue
+                if filter_files and name not in filter_files:
+                    continue
+                z.extract(name, output_path)
+                extracted.append(name)
+        progress.postfix = f"{len(extracted)} files extracted"
+        progress(spool.written, spool.total_length)
+        progress.close()
+        if cache is not None:
+            cache.store(url, spool_file, spool.headers)
+    except BaseException:
+        # do not wait for the rest of the archive
+        spool.cancel()
+        raise
+    finally:
+        spool.join()
+        spool.close()
+        if spool_file.is_file():
+            spool_file.unlink()
+    return extracted
+
+def extract_zip(
+        z: zipfile.ZipFile, output_path: Path, filter_files: List[str] = None):
+    """Extract all (or only filter_files) members of zip to output_path"""
+    if filter_files:
+        file_names = z.namelist()
+        for filename in file_names:
+            if filename in filter_files:
+                z.extract(filename, output_path)
+    else:
+        z.extractall(output_path)
 
 def get_zip_extract(
     output_path: Path, 
     uri: str = None, filename: str = None, uri_filename: str = None,
     create_path: bool = True, skip_exists: bool = True,
     report: bool = True, filter_files: List[str] = None,
-    write_intermediate: bool = None):
+    write_intermediate: bool = None, stream_extract: bool = None,
+    use_cache: bool = None):
     """Get Zip file and extract to output_path.
-    Create Path if not exists."""
+    Create Path if not exists.
+
+    stream_extract: If True, extract members while the archive
+        is still downloading (see stream_zip_extract).
+    use_cache: If True (default: USE_CACHE), archives are taken
+        from (and added to) the shared DownloadCache (TOOLS_CACHE_DIR),
+        revalidated with a conditional GET, and extracted directly
+        from the cached file. With stream_extract, the spooled archive
+        is moved into the cache, without another copy.
+    """
     if uri is None or filename is None:
         if uri_filename is None:
             raise ValueError("Either specify uri and filename or the complete url (uri_filename)")
@@ -292,6 +2317,8 @@ def get_zip_extract(
         uri = f"{url_prs.scheme}://{url_prs.netloc}{os.path.dirname(url_prs.path)}/"
     if write_intermediate is None:
         write_intermediate = False
+    if use_cache is None:
+        use_cache = USE_CACHE
     if create_path:
         output_path.mkdir(
             exist_ok=True)
@@ -302,31 +2329,178 @@ def get_zip_extract(
         if report:
             print("File already exists.. skipping download..")
         return
-    if write_intermediate:
+    cache = download_cache() if use_cache else None
+    cached_file = None
+    if stream_extract and cache is not None:
+        # stream only if the cached archive is missing or outdated
+        cached_file = cache.validate(f'{uri}{filename}')
+    if stream_extract and cached_file is None:
+        stream_zip_extract(
+            f'{uri}{filename}', output_path,
+            filter_files=filter_files, report=report, cache=cache)
+        if report:
+            raw_size_mb = get_folder_size(output_path, recursive=True)
+            print(
+                f"Retrieved {filename}, "
+                f"extracted size: {raw_size_mb:.2f} MB")
+        return
+    if cache is not None:
+        if cached_file is None:
+            cached_file = cache.fetch(f'{uri}{filename}')
+        # extract directly from cache
+        write_intermediate = False
+        z = zipfile.ZipFile(cached_file)
+    elif write_intermediate:
         out_file = output_path / filename
-        get_stream_file(f'{uri}{filename}', out_file)
+        get_stream_file(f'{uri}{filename}', out_file, use_cache=False)
         z = zipfile.ZipFile(out_file)
     else:
-        content = get_stream_bytes(
-            f'{uri}{filename}')
-        z = zipfile.ZipFile(io.BytesIO(content))
+        content = get_stream_view(
+            f'{uri}{filename}', report=report, use_cache=False)
+        z = zipfile.ZipFile(MemoryReader(content))
     print("Extracting zip..")
-    if filter_files:
-        file_names = z.namelist()
-        for filename in file_names:
-            if filename in filter_files:
-                z.extract(filename, output_path)
-    else:
-        z.extractall(output_path)
+    extract_zip(z, output_path, filter_files)
     if write_intermediate:
         if out_file.is_file():
             out_file.unlink()
     if report:
-        raw_size_mb = get_folder_size(output_path)
+        raw_size_mb = get_folder_size(output_path, recursive=True)
         print(
             f"Retrieved {filename}, "
             f"extracted size: {raw_size_mb:.2f} MB")
 
+FetchSpec = namedtuple('Fetch_spec', 'uri_filename, output_path, filter_files')
+
+async def fetch_many_async(
+        specs: Iterable[Tuple[str, Path, Optional[List[str]]]],
+        per_host: int = None, extract_workers: int = None,
+        report: bool = True) -> List[Path]:
+    """Download and extract many zip archives concurrently
+
+    Downloads run in threads, always via the shared DownloadCache
+    (regardless of USE_CACHE). At most per_host requests are open at
+    a time for each host, counting each part of range downloads.
+    Each url is downloaded once, even if it is listed in several
+    specs. Finished archives are extracted in
+    a separate thread pool, so that downloads continue while earlier
+    archives unpack. A single aggregate Progress replaces the
+    per-file reports.
+
+    If a download or extraction fails, pending work is cancelled and
+    running downloads and extractions are stopped before the
+    error is raised.
+
+    Args:
+        specs: List of (uri_filename, output_path, filter_files)
+    """
+    if per_host is None:
+        per_host = 4
+    if extract_workers is None:
+        extract_workers = 2
+    specs = [FetchSpec(*spec) for spec in specs]
+    loop = asyncio.get_running_loop()
+    cache = download_cache()
+    urls = list(dict.fromkeys(spec.uri_filename for spec in specs))
+    host_slots = {
+        urlparse(url).netloc: threading.BoundedSemaphore(per_host)
+        for url in urls}
+    cancel = threading.Event()
+    states = {url: [0, None] for url in urls}
+    extracted = 0
+    download_pool = ThreadPoolExecutor(
+        max_workers=max(len(host_slots) * per_host, 1))
+    extract_pool = ThreadPoolExecutor(max_workers=extract_workers)
+    progress = Progress(backend=None if report else "none")
+
+    def report_progress():
+        totals = [total for __, total in states.values()]
+        progress.postfix = f"{extracted} of {len(specs)} archives extracted"
+        progress(
+            sum(loaded for loaded, __ in states.values()),
+            sum(totals) if all(totals) else None)
+
+    def archive_progress(url: str):
+        def on_progress(loaded: int, total_length: Optional[int]):
+            states[url] = [loaded, total_length]
+        return on_progress
+
+    def extract(archive: Path, spec: FetchSpec):
+        spec.output_path.mkdir(parents=True, exist_ok=True)
+        with zipfile.ZipFile(archive) as z:
+            for name in z.namelist():
+                if cancel.is_set():
+                    raise CancelledError(f"Extraction of {archive} cancelled")
+                if spec.filter_files and name not in spec.filter_files:
+                    continue
+                z.extract(name, spec.output_path)
+
+    downloads = {
+        url: loop.run_in_executor(
+            download_pool, cache.fetch, url, archive_progress(url),
+            host_slots[urlparse(url).netloc], cancel)
+        for url in urls}
+
+    async def fetch(spec: FetchSpec) -> Path:
+        nonlocal extracted
+        archive = await downloads[spec.uri_filename]
+        await loop.run_in_executor(extract_pool, extract, archive, spec)
+        extracted += 1
+        return spec.output_path
+
+    tasks = [asyncio.ensure_future(fetch(spec)) for spec in specs]
+    try:
+        while not all(task.done() for task in tasks):
+            report_progress()
+            done, __ = await asyncio.wait(
+                tasks, timeout=progress.min_interval,
+                return_when=asyncio.FIRST_EXCEPTION)
+            if any(not task.cancelled() and task.exception()
+                   for task in done):
+                break
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        cancel.set()
+        for task in tasks:
+            task.cancel()
+        for future in downloads.values():
+            future.cancel()
+        raise
+    finally:
+        # running downloads and extractions stop at the next chunk
+        # (or member) once cancel is set; wait for them to end
+        await loop.run_in_executor(
+            None, lambda: download_pool.shutdown(cancel_futures=True))
+        await loop.run_in_executor(
+            None, lambda: extract_pool.shutdown(cancel_futures=True))
+    report_progress()
+    progress.close()
+    return results
+
+def fetch_many(
+        specs: Iterable[Tuple[str, Path, Optional[List[str]]]],
+        per_host: int = None, extract_workers: int = None,
+        report: bool = True) -> List[Path]:
+    """Download and extract many zip archives concurrently
+    (blocking wrapper for fetch_many_async)
+
+    Example:
+        tools.fetch_many([
+            (url_shapes, WORK_DIR / "shapes", None),
+            (url_occurrences, OUTPUT, ["occurrences_query.csv"])])
+
+    Jupyter already runs an event loop in the main thread;
+    in this case, the downloads are run in a separate thread.
+    """
+    coro = fetch_many_async(
+        specs, per_host=per_host,
+        extract_workers=extract_workers, report=report)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
 def zip_dir(path: Path, zip_file_path: Path):
     """Zip all contents of path to zip_file. Will not recurse subfolders."""
     files_to_zip = [
@@ -391,16 +2565,81 @@ def chunks(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
+PACKAGE_VERSIONS_FILE = CACHE_DIR / "package_versions.json"
+
+def _environment_key() -> str:
+    """Return key of installed packages: modification times of
+    site-packages folders (change on install/uninstall)"""
+    mtimes = [sys.prefix]
+    for path in sys.path:
+        if Path(path).name not in ("site-packages", "dist-packages"):
+            continue
+        try:
+            mtimes.append(f"{path}:{os.stat(path).st_mtime_ns}")
+        except OSError:
+            continue
+    return hashlib.sha1("\n".join(mtimes).encode()).hexdigest()
+
+def package_versions(names: Iterable[str]) -> Dict[str, Optional[Tuple[str, str]]]:
+    """Return (distribution name, version) per package name,
+    None for packages not installed
+
+    Names are distribution names (e.g. "python-dotenv") or import names
+    ("dotenv"). Results are cached in PACKAGE_VERSIONS_FILE, until
+    packages in the environment change.
+    """
+    key = _environment_key()
+    try:
+        cached = json.loads(PACKAGE_VERSIONS_FILE.read_text())
+    except (OSError, ValueError):
+        cached = {}
+    versions = {}
+    if cached.get("key") == key:
+        versions = cached["versions"]
+    missing = [name for name in names if name.lower() not in versions]
+    import_names = None
+    for name in missing:
+        try:
+            dist = importlib.metadata.distribution(name)
+        except importlib.metadata.PackageNotFoundError:
+            if import_names is None:
+                # scans all distributions, only needed for import names
+                import_names = importlib.metadata.packages_distributions()
+            dist_names = import_names.get(name)
+            if not dist_names:
+                versions[name.lower()] = None
+                continue
+            dist = importlib.metadata.distribution(dist_names[0])
+        versions[name.lower()] = [dist.metadata["Name"], dist.version]
+    if missing:
+        try:
+            PACKAGE_VERSIONS_FILE.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = PACKAGE_VERSIONS_FILE.with_suffix(f".{os.getpid()}.tmp")
+            tmp_file.write_text(json.dumps({"key": key, "versions": versions}))
+            os.replace(tmp_file, PACKAGE_VERSIONS_FILE)
+        except OSError:
+            pass
+    return {
+        name: None if versions[name.lower()] is None
+        else tuple(versions[name.lower()]) for name in names}
+
 def package_report(root_packages: List[str], python_version = True):
-    """Report package versions for root_packages entries"""
-    root_packages.sort(reverse=True)
+    """Report package versions for root_packages entries
+    (distribution or import names); unknown names are reported"""
     root_packages_list = []
     if python_version:
         pyv = platform.python_version()
         root_packages_list.append(["python", pyv])
-    for m in pkg_resources.working_set:
-        if m.project_name.lower() in root_packages:
-            root_packages_list.append([m.project_name, m.version])
+    names = sorted({name.lower() for name in root_packages} - {"python"})
+    versions = package_versions(names)
+    unknown = [name for name in names if versions[name] is None]
+    for name in names:
+        if versions[name] is not None:
+            root_packages_list.append(list(versions[name]))
+    if unknown:
+        print(
+            f"Unknown packages (not installed or misspelled): "
+            f"{', '.join(unknown)}")
     html_tables = ''
     for chunk in chunks(root_packages_list, 10):
         # get table HTML
@@ -443,32 +2682,31 @@ def tree(dir_path: Path, level: int = -1, limit_to_directories: bool = False,
     if ignore_match is None:
         ignore_match = ["_*", "*.pyc", "*.bak"]
 
+    ignore = ignore_pattern(ignore_files_folders, ignore_match)
+
     def inner(current_path: Path, prefix: str = '', level: int = -1, is_root=False):
         nonlocal files, directories
         if level == 0:
             return
 
-        try:
-            contents = [p for p in current_path.iterdir()
-                        if p.name not in ignore_files_folders and
-                        not any(fnmatch.fnmatch(p.name, pat) for pat in ignore_match)]
-        except PermissionError:
-            return
+        dir_entries, file_entries = scan_folder(current_path, ignore)
+        # sort_key receives Path objects
+        dirs = [Path(entry.path) for entry in dir_entries]
+        non_dirs = [Path(entry.path) for entry in file_entries]
+        dir_set = set(dirs)
 
         # At root: folders first, then files (both sorted)
         if is_root:
-            dirs = sorted([p for p in contents if p.is_dir()], key=sort_key)
-            non_dirs = sorted([p for p in contents if not p.is_dir()], key=sort_key)
-            contents = dirs + non_dirs
+            contents = sorted(dirs, key=sort_key) + sorted(non_dirs, key=sort_key)
         else:
-            contents = sorted(contents, key=sort_key)
+            contents = sorted(dirs + non_dirs, key=sort_key)
 
         pointers = [tee] * (len(contents) - 1) + [last]
         for pointer, path in zip(pointers, contents):
             line = prefix + pointer + path.name
             yield line
 
-            if path.is_dir():
+            if path in dir_set:
                 directories += 1
                 extension = branch if pointer == tee else space
                 yield from inner(path, prefix=prefix + extension, level=level - 1)
@@ -495,22 +2733,118 @@ def tree(dir_path: Path, level: int = -1, limit_to_directories: bool = False,
     """)
 
 
+HLL_COLUMNS = ['user_hll', 'post_hll', 'date_hll']
+HLL_CSV_COLUMNS = ['origin_id', 'latitude', 'longitude'] + HLL_COLUMNS
+HLL_CSV_CHUNKSIZE = 500000
+HLL_CSV_BLOCK_SIZE = 64 * 1024 * 1024
+
+def _hll_csv_header(file: Path) -> List[str]:
+    """Return HLL columns (HLL_CSV_COLUMNS) present in CSV header"""
+    with open(file, 'r', encoding="utf-8") as file_handle:
+        header = next(csv.reader(file_handle))
+    return [col for col in HLL_CSV_COLUMNS if col in header]
+
+def _hll_arrow_tables(
+        file: Path, columns: List[str], chunksize: int = None,
+        coords_dtype: np.dtype = None) -> Iterator:
+    """Read HLL CSV with pyarrow, yield tables of chunksize rows
+    (or a single table, if chunksize is None)"""
+    import pyarrow as pa
+    import pyarrow.csv as pcsv
+    column_types = {col: pa.string() for col in HLL_COLUMNS}
+    column_types.update({
+        col: pa.from_numpy_dtype(coords_dtype)
+        for col in ('latitude', 'longitude')})
+    convert_options = pcsv.ConvertOptions(
+        column_types=column_types, include_columns=columns)
+    read_options = pcsv.ReadOptions(block_size=HLL_CSV_BLOCK_SIZE)
+    if chunksize is None:
+        yield pcsv.read_csv(
+            file, read_options=read_options, convert_options=convert_options)
+        return
+    reader = pcsv.open_csv(
+        file, read_options=read_options, convert_options=convert_options)
+    pending = pa.Table.from_batches([], schema=reader.schema)
+    for batch in reader:
+        pending = pa.concat_tables(
+            [pending, pa.Table.from_batches([batch])])
+        while pending.num_rows >= chunksize:
+            yield pending.slice(0, chunksize)
+            pending = pending.slice(chunksize)
+    if pending.num_rows:
+        yield pending
+
+def _hll_arrow_frame(
+        table, categorical: bool, index: List[str] = None) -> pd.DataFrame:
+    """Arrow table to DataFrame, hll columns dictionary encoded"""
+    if categorical:
+        for col in HLL_COLUMNS:
+            if col in table.column_names:
+                table = table.set_column(
+                    table.column_names.index(col), col,
+                    table[col].dictionary_encode())
+    df = table.to_pandas()
+    if index:
+        df.set_index(index, inplace=True)
+    return df
+
+def read_hll_csv(
+        file: Path, chunksize: int = None, index: List[str] = None,
+        coords_dtype: np.dtype = None, categorical: bool = True,
+        nrows: int = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """Read HLL CSV (latitude, longitude, user_hll, post_hll, date_hll,
+    optional origin_id) into typed, columnar DataFrames
+
+    Args:
+        file: Path to CSV with HLL columns (other columns are skipped).
+        chunksize: If set, returns an iterator of DataFrames with
+            chunksize rows each (e.g. HLL_CSV_CHUNKSIZE), for
+            files larger than memory.
+        index: Optional columns to set as index, e.g.
+            ["latitude", "longitude"] for union_hll_series.
+        coords_dtype: dtype of latitude/longitude. Defaults to
+            np.float32 (~1 m precision, sufficient for binned data).
+        categorical: Store hll columns as categoricals (dictionary
+            encoded strings); repeated hll sets are stored once.
+        nrows: Only read the first nrows rows (e.g. for previews).
+
+    Uses pyarrow (multi-threaded) if available, otherwise pandas.
+    """
+    if coords_dtype is None:
+        coords_dtype = np.float32
+    columns = _hll_csv_header(file)
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+    if pyarrow is None or nrows is not None:
+        dtypes = {col: coords_dtype for col in ('latitude', 'longitude')}
+        dtypes.update({
+            col: 'category' if categorical else str for col in HLL_COLUMNS})
+        reader = pd.read_csv(
+            file, usecols=columns, dtype=dtypes, chunksize=chunksize,
+            nrows=nrows, index_col=index)
+        return reader
+    frames = (
+        _hll_arrow_frame(table, categorical, index)
+        for table in _hll_arrow_tables(file, columns, chunksize, coords_dtype))
+    if chunksize is None:
+        return next(frames)
+    return frames
+
 def record_preview_hll(file: Path, num: int = 0):
     """Get record preview for hll data"""
-    with open(file, 'r', encoding="utf-8") as file_handle:
-        post_reader = csv.DictReader(
-                    file_handle,
-                    delimiter=',',
-                    quotechar='"',
-                    quoting=csv.QUOTE_MINIMAL)
-        for ix, hll_record in enumerate(post_reader):
-            hll_record = get_hll_record(hll_record, strip=True)
-            # convert to df for display
-            display(pd.DataFrame(data=[hll_record]).rename_axis(
-                f"Record {ix}", axis=1).transpose().style.background_gradient(cmap='viridis'))
-            # stop iteration after x records
-            if ix >= num:
-                break
+    # float64 coordinates, displayed as in the file (e.g. 51.1)
+    df = read_hll_csv(
+        file, nrows=num + 1, coords_dtype=np.float64, categorical=False)
+    for col in HLL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].where(
+                df[col].str.len() <= 120, df[col].str[:120] + '..')
+    for ix in range(len(df)):
+        # convert to df for display
+        display(df.iloc[[ix]].reset_index(drop=True).rename_axis(
+            f"Record {ix}", axis=1).transpose().style.background_gradient(cmap='viridis'))
 
 HllRecord = namedtuple('Hll_record', 'latitude, longitude, user_hll, post_hll, date_hll')
 HllOriginRecord = namedtuple('HllOrigin_record', 'origin_id, latitude, longitude, user_hll, post_hll, date_hll')
@@ -533,53 +2867,123 @@ def get_hll_record(record, strip: bool = None):
     cols = ['user_hll', 'post_hll', 'date_hll']
     col_vals = []
     for col in cols:
-        col_val = record.get('user_hll')
         col_vals.append(strip_item(record.get(col), strip))
     if not origin_id is None:
         return HllOriginRecord(origin_id, latitude, longitude, *col_vals)
     return HllRecord(latitude, longitude, *col_vals)
 
+HLL_BATCH_SIZE = 100000
+
+def hll_int_array(cardinalities: np.ndarray) -> pd.api.extensions.ExtensionArray:
+    """Round cardinalities to a nullable Int64 array (NaN to <NA>);
+    ::int in postgres rounds half to even, as np.rint"""
+    return pd.array(np.rint(cardinalities), dtype="Int64")
+
+def _hll_cardinality_values(hll_values: List[str], db_conn: DbConn) -> np.ndarray:
+    """HLL cardinality of hll sets, bound as a single hll[] parameter"""
+    df = db_conn.query("""
+        SELECT s.ix,
+               hll_cardinality(s.hll_set)::int AS hll_cardinality
+        FROM unnest(%s::hll[]) WITH ORDINALITY s(hll_set, ix)
+        ORDER BY ix ASC
+        """, params=[hll_values], cache=False)
+    return df["hll_cardinality"].values
+
+def _hll_cardinality_copy(hll_values: List[str], db_conn: DbConn) -> np.ndarray:
+    """HLL cardinality of hll sets, streamed with COPY
+    into a temporary table"""
+    buffer = io.StringIO()
+    pd.DataFrame({
+        "ix": np.arange(len(hll_values)),
+        "hll_set": hll_values}).to_csv(buffer, header=False, index=False)
+    db_conn.execute("TRUNCATE _hll_input")
+    db_conn.copy_csv("_hll_input", ["ix", "hll_set"], buffer)
+    df = db_conn.query("""
+        SELECT ix, hll_cardinality(hll_set)::int AS hll_cardinality
+        FROM _hll_input
+        ORDER BY ix ASC
+        """, cache=False)
+    return df["hll_cardinality"].values
+
 def hll_series_cardinality(
-    hll_series: pd.Series, db_conn: DbConn,) -> pd.Series:
+    hll_series: pd.Series, db_conn: DbConn = None,
+    batch_size: int = None, use_copy: bool = None) -> pd.Series:
     """HLL cardinality estimation from a series of hll sets
 
     Args:
         hll_series: Indexed series of hll sets. 
+        db_conn: Postgres connection (with hll extension). If None,
+            cardinalities are estimated locally (see modules/hll.py).
+        batch_size: Number of hll sets sent to (and counted in)
+            Postgres per batch. Defaults to HLL_BATCH_SIZE.
+        use_copy: If True, hll sets are streamed with COPY FROM STDIN
+            into a temporary table, instead of being bound as
+            a single (very large) hll[] query parameter. Defaults to True
+            for connections that support COPY (psycopg2, psycopg 3).
+
+    Returns a series (nullable Int64) with the same index as
+    hll_series; cardinalities of undefined hll sets are <NA>.
     """
-    # create list of hll values for pSQL
-    hll_values_list = ",".join(
-        [f"({ix}::int,'{hll_item}'::hll)" 
-         for ix, hll_item
-         in enumerate(hll_series.values.tolist())])
-    # Compilation of SQL query
-    return_col = hll_series.name
-    db_query = f"""
-        SELECT s.ix,
-               hll_cardinality(s.hll_set)::int AS {return_col}
-        FROM (
-            VALUES {hll_values_list}
-            ) s(ix, hll_set)
-        ORDER BY ix ASC
-        """
-    df = db_conn.query(db_query)
-    # to merge values back to grouped dataframe,
-    # first reset index to ascending integers
-    # matching those of the returned df;
-    # this will turn series_grouped into a DataFrame;
-    # the previous index will still exist in column 'index'
-    df_series = hll_series.reset_index()
-    # drop hll sets not needed anymore
-    df_series.drop(columns=[hll_series.name], inplace=True)
-    # append hll_cardinality counts 
-    # using matching ascending integer indexes
-    df_series.loc[df.index, return_col] = df[return_col].values
-    # set index back to original multiindex
-    df_series.set_index(hll_series.index.names, inplace=True)
-    # return as series
-    return df_series[return_col].astype(np.int64)
+    if db_conn is None:
+        cardinalities = hll.cardinality(
+            hll.decode(hll_series.values.tolist()))
+        return pd.Series(
+            hll_int_array(cardinalities),
+            index=hll_series.index, name=hll_series.name)
+    if batch_size is None:
+        batch_size = HLL_BATCH_SIZE
+    if use_copy is None:
+        use_copy = db_conn.supports_copy()
+    hll_values = hll_series.values.tolist()
+    # float, to hold NULL (undefined sets) as NaN
+    cardinalities = np.empty(len(hll_values), dtype=np.float64)
+    cardinality_batch = _hll_cardinality_values
+    # temp table is per connection: pin one pooled connection
+    with db_conn.connection():
+        try:
+            if use_copy:
+                db_conn.execute(
+                    "CREATE TEMP TABLE IF NOT EXISTS _hll_input "
+                    "(ix int, hll_set hll)")
+                cardinality_batch = _hll_cardinality_copy
+            for start in range(0, len(hll_values), batch_size):
+                batch = hll_values[start:start + batch_size]
+                cardinalities[start:start + len(batch)] = cardinality_batch(
+                    batch, db_conn)
+            if use_copy:
+                db_conn.execute("DROP TABLE IF EXISTS _hll_input")
+        except Exception:
+            # leave connection usable for the next query
+            if use_copy:
+                db_conn.rollback()
+            raise
+    return pd.Series(
+        hll_int_array(cardinalities),
+        index=hll_series.index, name=hll_series.name)
+
+def union_hll_series_local(
+        hll_series: pd.Series, cardinality: bool = True) -> pd.Series:
+    """HLL Union and (optional) cardinality estimation from series of hll sets
+    based on group by (composite) index, without database (see modules/hll.py)
+
+    hll sets are decoded to NumPy register arrays and unioned per group
+    (register-wise maximum); results match hll_union_agg and
+    hll_cardinality(..)::int of postgresql-hll.
+    """
+    codes, uniques = hll_series.index.factorize(sort=True)
+    union = hll.union_agg(
+        hll.decode(hll_series.values.tolist()), codes)
+    index = uniques.copy()
+    index.names = hll_series.index.names
+    if cardinality:
+        return pd.Series(
+            hll_int_array(hll.cardinality(union)),
+            index=index, name="hll_cardinality")
+    return pd.Series(
+        hll.encode(union), index=index, name="hll_union")
 
 def union_hll_series(
-    hll_series: pd.Series, db_conn: DbConn, cardinality: bool = True, multiindex: bool = None) -> pd.Series:
+    hll_series: pd.Series, db_conn: DbConn = None, cardinality: bool = True, multiindex: bool = None) -> pd.Series:
     """HLL Union and (optional) cardinality estimation from series of hll sets
     based on group by composite index.
 
@@ -588,6 +2992,8 @@ def union_hll_series(
         cardinality: If True, returns cardinality (counts). Otherwise,
             the unioned hll set will be returned.
         multiindex: Specify, whether Series is indexed with a multiindex (a composite index)
+        db_conn: Postgres connection (with hll extension). If None,
+            the union is computed locally (see union_hll_series_local).
             
     The method will combine all groups of hll sets first,
         in a single SQL command. Union of hll-sets belonging 
@@ -607,23 +3013,28 @@ def union_hll_series(
         
     cardinality = False should be used when incrementally union
         of hll sets is required, e.g. due to size of input data.
-        In the last run, set to cardinality = True.
+        In the last run, set to cardinality = True. See
+        union_hll_series_chunked, which does this in bounded batches.
     """
+    if db_conn is None:
+        return union_hll_series_local(hll_series, cardinality=cardinality)
     # group all hll-sets per index (bin-id)
     series_grouped = hll_series.groupby(
         hll_series.index).apply(list)
-    # From grouped hll-sets,
-    # construct a single SQL Value list;
+    # From grouped hll-sets, construct two flat arrays
+    # (group index, hll set), bound as parameters;
     # if the following nested list comprehension
     # doesn't make sense to you, have a look at
     # spapas.github.io/2016/04/27/python-nested-list-comprehensions/
     # with a decription on how to 'unnest'
     # nested list comprehensions to regular for-loops
-    hll_values_list = ",".join(
-        [f"({ix}::int,'{hll_item}'::hll)" 
-         for ix, hll_items
-         in enumerate(series_grouped.values.tolist())
-         for hll_item in hll_items])
+    group_ix_list = [
+        ix for ix, hll_items
+        in enumerate(series_grouped.values.tolist())
+        for __ in hll_items]
+    hll_values_list = [
+        hll_item for hll_items in series_grouped.values.tolist()
+        for hll_item in hll_items]
     # Compilation of SQL query,
     # depending on whether to return the cardinality
     # of unioned hll or the unioned hll
@@ -637,19 +3048,20 @@ def union_hll_series(
         return_col = "hll_cardinality"
         hll_calc_pre = "hll_cardinality("
         hll_calc_tail = ")::int"
+    # query text only depends on cardinality,
+    # the prepared plan is reused across calls
     db_query = f"""
         SELECT sq.{return_col} FROM (
             SELECT s.group_ix,
                    {hll_calc_pre}
                    hll_union_agg(s.hll_set)
                    {hll_calc_tail}
-            FROM (
-                VALUES {hll_values_list}
-                ) s(group_ix, hll_set)
+            FROM unnest(%s::int[], %s::hll[]) s(group_ix, hll_set)
             GROUP BY group_ix
             ORDER BY group_ix ASC) sq
         """
-    df = db_conn.query(db_query)
+    df = db_conn.query(
+        db_query, params=[group_ix_list, hll_values_list], cache=False)
     # to merge values back to grouped dataframe,
     # first reset index to ascending integers
     # matching those of the returned df;
@@ -671,28 +3083,116 @@ def union_hll_series(
         df_grouped.set_index(hll_series.index.names, inplace=True)
     series = df_grouped[return_col]
     if cardinality:
-         return series.astype(np.int64)
+        # nullable: undefined hll sets have no cardinality (NULL)
+        return series.astype("Int64")
     return series
 
+def hll_group_batches(
+        hll_series: pd.Series, batch_size: int) -> Iterator[pd.Series]:
+    """Split series into batches of about batch_size hll sets,
+    without splitting groups (index values) across batches"""
+    codes, __ = hll_series.index.factorize(sort=True)
+    order = np.argsort(codes, kind='stable')
+    codes = codes[order]
+    group_starts = np.flatnonzero(
+        np.concatenate([[True], codes[1:] != codes[:-1]]))
+    group_batches = group_starts // batch_size
+    # first position of each batch, at group boundaries
+    batch_starts = group_starts[np.concatenate(
+        [[True], group_batches[1:] != group_batches[:-1]])]
+    for start, end in zip(batch_starts, np.append(batch_starts[1:], len(codes))):
+        yield hll_series.iloc[order[start:end]]
+
+def union_hll_series_chunked(
+        hll_series: Union[pd.Series, Iterable[pd.Series]],
+        db_conn: DbConn = None, cardinality: bool = True,
+        batch_size: int = None) -> pd.Series:
+    """Incremental HLL Union and (optional) cardinality estimation
+    for inputs too large for a single union_hll_series call
+
+    Each input series is partitioned by group into batches of about
+    batch_size hll sets; each batch is unioned (cardinality=False) and
+    folded into the partial unions of previous batches. Cardinality is
+    estimated once, in the final pass. Memory is bounded by batch_size
+    and the number of groups, not by the input size.
+
+    Args:
+        hll_series: Indexed series (bins) of hll sets, or an iterator
+            of such series, e.g. from CSV chunks:
+                (df.set_index(["latitude", "longitude"])["user_hll"]
+                 for df in pd.read_csv(file, chunksize=100000))
+        db_conn: Postgres connection (with hll extension). If None,
+            unions are computed locally (see union_hll_series_local).
+        cardinality: If True, returns cardinality (counts). Otherwise,
+            the unioned hll set will be returned.
+        batch_size: Max. number of hll sets per union. Defaults to
+            HLL_BATCH_SIZE.
+    """
+    if batch_size is None:
+        batch_size = HLL_BATCH_SIZE
+    if isinstance(hll_series, pd.Series):
+        hll_series = [hll_series]
+    partial = None
+    index_names = [None]
+    for chunk in hll_series:
+        index_names = chunk.index.names
+        if chunk.empty:
+            continue
+        for batch in hll_group_batches(chunk, batch_size):
+            if partial is not None:
+                # fold forward: previous unions of groups in this batch
+                # re-enter the union as hll sets
+                touched = partial.index.isin(batch.index)
+                batch = pd.concat([
+                    partial[touched].rename(batch.name), batch])
+                partial = partial[~touched]
+            union = union_hll_series(
+                batch, db_conn, cardinality=False,
+                multiindex=isinstance(batch.index, pd.MultiIndex))
+            union.index.names = batch.index.names
+            if partial is None:
+                partial = union
+            else:
+                partial = pd.concat([partial, union])
+    if partial is None:
+        # no hll sets (empty input): no groups
+        if len(index_names) > 1:
+            index = pd.MultiIndex.from_arrays(
+                [[]] * len(index_names), names=index_names)
+        else:
+            index = pd.Index([], name=index_names[0])
+        if cardinality:
+            return pd.Series(
+                [], index=index, dtype="Int64", name="hll_cardinality")
+        return pd.Series([], index=index, dtype=str, name="hll_union")
+    partial = partial.sort_index()
+    if not cardinality:
+        return partial
+    return hll_series_cardinality(
+        partial, db_conn).rename("hll_cardinality")
+
 def check_table_exists(
         db_conn: DbConn, table_name: str, schema: str = None) -> bool:
     """Check if a table exists or not, using db_conn and table_name"""
     if not schema:
         schema = 'mviews'
-    sql_query = f"""
+    sql_query = """
     SELECT EXISTS (
        SELECT FROM information_schema.tables 
-       WHERE  table_schema = '{schema}'
-       AND    table_name   = '{table_name}'
+       WHERE  table_schema = %s
+       AND    table_name   = %s
        );
     """
-    result = db_conn.query(sql_query)
+    params = [schema, table_name]
+    # catalog probe, never cached
+    result = db_conn.query(sql_query, params=params, cache=False)
     return result["exists"][0]
 
 def get_shapes(
         reference: str, shape_dir: Path,
         clean_cols: Optional[bool] = None, normalize_cols: Optional[bool] = None,
-        set_index: Optional[bool] = None, project_wgs84: Optional[bool] = None) -> gp.GeoDataFrame:
+        set_index: Optional[bool] = None, project_wgs84: Optional[bool] = None,
+        use_cache: Optional[bool] = None) -> gp.GeoDataFrame:
     """Custom method to get frequently used shapes (DE Bundesländer, US States)
     and return a geopandas.GeoDataFrame (WGS1984)
 
@@ -701,6 +3201,7 @@ def get_shapes(
     normalize_cols: will rename columns to sane defaults. Defaults to True.
     set_index: will set state-reference as index column. Defaults to True.
     project_wgs84: Project shapes to WGS1984. Defaults to True.
+    use_cache: Download through the shared DownloadCache. Defaults to USE_CACHE.
     """
     if clean_cols is None:
         clean_cols = True
@@ -732,7 +3233,8 @@ def get_shapes(
     # test if file already downloaded
     if not (shape_dir / shapes_name).exists():
         get_zip_extract(
-            uri=source_zip, filename=filename, output_path=shape_dir)
+            uri=source_zip, filename=filename, output_path=shape_dir,
+            use_cache=use_cache)
     else:
         print("Already exists")
     shapes = gp.read_file(shape_dir / shapes_name)
@@ -829,7 +3331,7 @@ def annotate_locations_fit(
                         alpha=0.5)))
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=UserWarning)        
-        adjust_text(
+        adjustText.adjust_text(
             texts, autoalign='y', ax=ax,
             arrowprops=dict(
                 arrowstyle="simple, head_length=2, head_width=2, tail_width=.2",
@@ -897,16 +3399,41 @@ def display_debug_dict(debug_dict, transposed: bool = None):
 def is_nan(x):
     return (x is np.nan or x != x)
 
+def points_from_xy(
+        x: np.ndarray, y: np.ndarray, crs=None, index=None) -> gp.GeoSeries:
+    """Build a Geopandas GeoSeries of points from coordinate arrays
+    (e.g. lng/lat columns), with the vectorized shapely constructor
+    instead of a Point() per coordinate (crs defaults to EPSG:4326)"""
+    if crs is None:
+        crs = "EPSG:4326"
+    return gp.GeoSeries(
+        gp.points_from_xy(
+            np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)),
+        index=index, crs=crs)
+
+def points_to_xy(points: gp.GeoSeries) -> Tuple[np.ndarray, np.ndarray]:
+    """Return x and y coordinate arrays of a GeoSeries of points"""
+    return points.geometry.x.to_numpy(), points.geometry.y.to_numpy()
+
 def series_to_point(
-        points: gp.GeoSeries, crs=crs.Mollweide(), 
+        points: gp.GeoSeries, crs=None, 
         mod_x: Optional[int] = 0, mod_y: Optional[int] = 0) -> gv.Points:
-    """Convert a Geopandas Geoseries of points to a Geoviews Points layer"""
-    return gv.Points(
-        [(point.x+mod_x, point.y+mod_y) for point in points.geometry], crs=crs)
-
-def series_to_label(points: gp.GeoSeries, crs=crs.Mollweide()) -> List[gv.Text]:
-    """Convert a Geopandas Geoseries of points to a list of Geoviews Text label layers"""
-    return [gv.Text(point.x+300000, point.y+300000, str(i+1), crs=crs) for i, point in enumerate(points.geometry)]
+    """Convert a Geopandas Geoseries of points to a Geoviews Points layer
+    (crs defaults to Mollweide)"""
+    if crs is None:
+        crs = ccrs.Mollweide()
+    x, y = points_to_xy(points)
+    return gv.Points((x + mod_x, y + mod_y), crs=crs)
+
+def series_to_label(points: gp.GeoSeries, crs=None) -> List[gv.Text]:
+    """Convert a Geopandas Geoseries of points to a list of Geoviews Text label layers
+    (crs defaults to Mollweide)"""
+    if crs is None:
+        crs = ccrs.Mollweide()
+    x, y = points_to_xy(points)
+    return [
+        gv.Text(x_i+300000, y_i+300000, str(i+1), crs=crs)
+        for i, (x_i, y_i) in enumerate(zip(x, y))]
 
 def _svg_to_pdf(filename: Path, out_dir: Optional[Path] = None):
     """Convert a svg on disk to a pdf using cairosvg"""
@@ -962,11 +3489,13 @@ def convert_svg_pdf(in_dir: Path,  out_dir: Optional[Path] = None):
     out_dir.mkdir(exist_ok=True)
     files_folders = Path(in_dir).glob('*.svg')
     files_svg = [x for x in files_folders if x.is_file()]
-    for cnt, file in enumerate(files_svg):
-        svg_to_pdf_chromium(
-            filename=file, out_dir=out_dir)
-        clear_output(wait=True)
-        print(f"Processed {cnt+1} of {len(files_svg)} files..")
+    with Progress(
+            total=len(files_svg), label="Processed",
+            unit="files", scale=1) as progress:
+        for file in files_svg:
+            svg_to_pdf_chromium(
+                filename=file, out_dir=out_dir)
+            progress.add(1)
 
 def min_max_lim(min_v: int, max_v: int, centroid, orig_centroid):
     if np.isinf(centroid):
@@ -999,7 +3528,7 @@ def project_point(
     """Project a single or multiple points given two CRS"""
     if not point is None:
         points = [point]
-    transformer = Transformer.from_crs(crs_in, crs_out, always_xy=True)
+    transformer = pyproj.Transformer.from_crs(crs_in, crs_out, always_xy=True)
     if not point is None:
         return transformer.itransform(point)
     points_proj = []
@@ -1022,6 +3551,85 @@ def project_bounds(
     return (west, south, east, north)
 
 
+BIN_CRS = "EPSG:3035"
+BIN_RESOLUTIONS = [1000]
+
+def bin_coordinates(
+        longitude: np.ndarray, latitude: np.ndarray,
+        resolutions: Iterable[int] = None, crs_in: str = None,
+        crs_out: str = None) -> pd.DataFrame:
+    """Assign coordinates to the bins of regular grids in a projected CRS
+
+    Coordinates are projected once (vectorised), floored to integer
+    CRS units and snapped to multiples of each resolution. Bin ids are
+    the lower-left bin corners (xbin_{res}, ybin_{res}), aligned with
+    grids such as the EPSG:3035 Monitor rasters.
+
+    Args:
+        longitude, latitude: Coordinate arrays (in crs_in).
+        resolutions: Bin sizes in CRS units, e.g. [200, 1000, 10000].
+            Defaults to BIN_RESOLUTIONS.
+        crs_in: CRS of coordinates. Defaults to EPSG:4326.
+        crs_out: Projected CRS of the grid. Defaults to BIN_CRS.
+    """
+    if resolutions is None:
+        resolutions = BIN_RESOLUTIONS
+    if crs_in is None:
+        crs_in = "EPSG:4326"
+    if crs_out is None:
+        crs_out = BIN_CRS
+    transformer = pyproj.Transformer.from_crs(crs_in, crs_out, always_xy=True)
+    x, y = transformer.transform(
+        np.asarray(longitude, dtype=np.float64),
+        np.asarray(latitude, dtype=np.float64))
+    invalid = ~(np.isfinite(x) & np.isfinite(y))
+    if invalid.any():
+        raise ValueError(
+            f"{invalid.sum()} coordinates cannot be projected to {crs_out}")
+    x = np.floor(x).astype(np.int64)
+    y = np.floor(y).astype(np.int64)
+    bins = {}
+    for resolution in resolutions:
+        resolution = int(resolution)
+        # np.mod is non-negative, bins are floored for negative x/y too
+        bins[f"xbin_{resolution}"] = x - np.mod(x, resolution)
+        bins[f"ybin_{resolution}"] = y - np.mod(y, resolution)
+    return pd.DataFrame(bins)
+
+def bin_hll_series(
+        df: pd.DataFrame, resolutions: Iterable[int] = None,
+        hll_col: str = None, crs_out: str = None) -> Dict[int, pd.Series]:
+    """Index hll sets of HLL records by grid bin, for each resolution
+
+    Args:
+        df: HLL records with latitude and longitude (as columns or
+            index levels, see read_hll_csv) and hll_col.
+        resolutions: Bin sizes in CRS units. Defaults to BIN_RESOLUTIONS.
+        hll_col: hll column to bin. Defaults to "user_hll".
+        crs_out: Projected CRS of the grid. Defaults to BIN_CRS.
+
+    Returns a dict of hll series per resolution, indexed by
+    (xbin, ybin), ready for union_hll_series.
+    """
+    if resolutions is None:
+        resolutions = BIN_RESOLUTIONS
+    if hll_col is None:
+        hll_col = "user_hll"
+    if "latitude" not in df.columns:
+        df = df.reset_index()
+    bins = bin_coordinates(
+        df["longitude"].values, df["latitude"].values,
+        resolutions=resolutions, crs_out=crs_out)
+    hll_values = df[hll_col].values
+    series = {}
+    for resolution in resolutions:
+        resolution = int(resolution)
+        index = pd.MultiIndex.from_arrays([
+            bins[f"xbin_{resolution}"].values,
+            bins[f"ybin_{resolution}"].values], names=["xbin", "ybin"])
+        series[resolution] = pd.Series(hll_values, index=index, name=hll_col)
+    return series
+
 def get_cmap(n, name='hsv'):
     '''Returns a function that maps each index in 0, 1, ..., n-1 to a distinct 
     RGB color; the keyword argument name must be a standard mpl colormap name.'''
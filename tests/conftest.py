@@ -0,0 +1,9 @@
+"""Shared setup for tests of py/modules (run with: python -m pytest tests)"""
+
+import sys
+from pathlib import Path
+
+# notebooks import modules from py/ (from modules import tools)
+sys.path.insert(0, str(Path(__file__).parents[1] / "py"))
+
+DATA_DIR = Path(__file__).parent / "data"
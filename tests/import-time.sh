@@ -0,0 +1,23 @@
+#!/bin/sh
+
+# Fail if importing py/modules/tools.py takes longer than the budget
+# (cumulative time reported by python -X importtime, in milliseconds)
+
+MAX_IMPORT_MS=${MAX_IMPORT_MS:-1500}
+MODULE="modules.tools"
+PY_DIR="$(dirname "$0")/../py"
+
+IMPORT_US=$(cd "${PY_DIR}" && python3 -X importtime -c "import ${MODULE}" 2>&1 \
+    | awk -F'|' -v module="${MODULE}" '$3 ~ " "module"$" {gsub(/ /, "", $2); print $2}')
+
+if [ -z "${IMPORT_US}" ]; then
+    echo "Could not import ${MODULE}"
+    exit 1
+fi
+
+IMPORT_MS=$((IMPORT_US / 1000))
+echo "Import of ${MODULE}: ${IMPORT_MS} ms (budget: ${MAX_IMPORT_MS} ms)"
+if [ "${IMPORT_MS}" -gt "${MAX_IMPORT_MS}" ]; then
+    exit 1
+fi
+exit 0
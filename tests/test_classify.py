@@ -0,0 +1,26 @@
+"""Raster classification: classify_mask and classify_data"""
+
+import numpy as np
+import pytest
+
+from modules import tools
+
+
+def test_classify_data_significant():
+    values = np.arange(1, 13, dtype=float).reshape(3, 4)
+    significant = values > 4
+    result = tools.classify_data(
+        values, "Quantiles", k=2, mask_nonsignificant=True,
+        significant=significant, store_classes=True)
+    assert result.classes.shape == values.shape
+    assert (result.classes[~significant] == tools.CLASS_NODATA).all()
+    assert (result.classes[significant] != tools.CLASS_NODATA).all()
+
+
+@pytest.mark.parametrize("shape", [(12,), (4, 3), (1, 4)])
+def test_classify_significant_shape_mismatch(shape):
+    values = np.arange(1, 13, dtype=float).reshape(3, 4)
+    with pytest.raises(ValueError, match="shape"):
+        tools.classify_data(
+            values, "Quantiles", k=2, mask_nonsignificant=True,
+            significant=np.ones(shape, dtype=bool))
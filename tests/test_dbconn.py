@@ -0,0 +1,203 @@
+"""DbConn connection pool (sqlite3 stands in for Postgres)"""
+
+import sqlite3
+import threading
+from functools import partial
+
+import numpy as np
+import pytest
+
+from modules import tools
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "test.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE numbers (n INTEGER)")
+    conn.executemany(
+        "INSERT INTO numbers VALUES (?)", [(n,) for n in range(5)])
+    conn.commit()
+    conn.close()
+    return partial(sqlite3.connect, path, check_same_thread=False)
+
+
+def test_query_iter_does_not_pin(database):
+    db = tools.DbConn(connect=database, pool_size=2)
+    chunks = db.query_iter("SELECT n FROM numbers ORDER BY n", chunksize=2)
+    first = next(chunks)
+    with db.connection() as conn:
+        rest = list(chunks)
+        with db.connection() as inner:
+            assert inner is conn
+    values = [n for chunk in [first, *rest] for n in chunk["n"]]
+    assert values == list(range(5))
+    assert db._idle.qsize() == 2
+
+
+def test_query_iter_fails_fast_with_one_connection(database):
+    db = tools.DbConn(database())
+    with db.connection():
+        with pytest.raises(RuntimeError):
+            next(db.query_iter("SELECT n FROM numbers"))
+    assert len(list(db.query_iter("SELECT n FROM numbers"))) == 1
+
+
+def run_with_timeout(target, timeout: float = 10):
+    """Run target in a thread, fail instead of hanging"""
+    result = []
+    thread = threading.Thread(
+        target=lambda: result.append(target()), daemon=True)
+    thread.start()
+    thread.join(timeout=timeout)
+    assert not thread.is_alive(), "deadlock"
+    return result[0]
+
+
+def test_query_inside_query_iter_loop(database):
+    db = tools.DbConn(database())
+    def run():
+        totals = []
+        for chunk in db.query_iter(
+                "SELECT n FROM numbers ORDER BY n", chunksize=2):
+            count = db.query(
+                "SELECT count(*) AS n FROM numbers WHERE n <= ?",
+                params=[int(chunk["n"].max())])
+            counts = db.query_many(["SELECT 1 AS n", "SELECT 2 AS n"])
+            totals.append(
+                (int(count["n"][0]), [int(df["n"][0]) for df in counts]))
+        return totals
+    assert run_with_timeout(run) == [
+        (2, [1, 2]), (4, [1, 2]), (5, [1, 2])]
+    assert db._idle.qsize() == 1
+    assert db._iter_conns == {}
+
+
+def test_nested_query_iter_fails_fast(database):
+    db = tools.DbConn(database())
+    def run():
+        for __ in db.query_iter("SELECT n FROM numbers"):
+            with pytest.raises(RuntimeError):
+                next(db.query_iter("SELECT n FROM numbers"))
+        return True
+    assert run_with_timeout(run)
+
+
+def test_query_many_reuses_caller_connection(database):
+    db = tools.DbConn(database())
+    result = []
+    def run():
+        with db.connection() as conn:
+            conn.execute(
+                "CREATE TEMP TABLE squares AS SELECT n * n AS n FROM numbers")
+            result.extend(db.query_many([
+                "SELECT sum(n) AS n FROM numbers",
+                "SELECT sum(n) AS n FROM squares"]))
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert [df["n"][0] for df in result] == [10, 30]
+
+
+def test_query_many_parallel(database):
+    db = tools.DbConn(connect=database, pool_size=3)
+    result = db.query_many(
+        [f"SELECT count(*) AS n FROM numbers WHERE n < {n}" for n in range(6)])
+    assert [df["n"][0] for df in result] == [0, 1, 2, 3, 4, 5]
+
+
+class Psycopg2Cursor:
+    """Records statements, as executed by a psycopg2 connection"""
+    def __init__(self, log):
+        self.log = log
+        self.description = [("n",)]
+
+    def execute(self, sql_query, params=None):
+        self.log.append((sql_query, params))
+
+    def fetchall(self):
+        return [(1,)]
+
+    def close(self):
+        pass
+
+
+class Psycopg2Connection:
+    def __init__(self):
+        self.log = []
+
+    def cursor(self):
+        return Psycopg2Cursor(self.log)
+
+
+Psycopg2Connection.__module__ = "psycopg2.extensions"
+
+
+def test_prepare_statement():
+    assert tools.prepare_statement(
+        "q", "SELECT * FROM unnest(%s::int[], %s::hll[]) WHERE x LIKE 'a%%'",
+        ["bigint[]", "text[]"]) == (
+        "PREPARE q (bigint[], text[]) AS "
+        "SELECT * FROM unnest($1::int[], $2::hll[]) WHERE x LIKE 'a%'")
+    assert tools.prepare_statement("q", "SELECT 1", []) == (
+        "PREPARE q AS SELECT 1")
+
+
+@pytest.mark.parametrize("param, pg_type", [
+    (["\\x118b48"], "text[]"),
+    ([1, 2], "bigint[]"),
+    ([1, 2.5], "double precision[]"),
+    ([], "text[]"),
+    ("a", "text"),
+    (True, "boolean"),
+    (None, None),
+    ([None], None),
+    ([[1]], None),
+])
+def test_pg_param_type(param, pg_type):
+    assert tools._pg_param_type(param) == pg_type
+
+
+def test_psycopg2_prepare_typed():
+    conn = Psycopg2Connection()
+    db = tools.DbConn(conn)
+    sql_query = (
+        "SELECT hll_cardinality(hll_union_agg(h)) FROM unnest(%s::hll[]) h")
+    for values in (["\\x118b48"], ["\\x118b48", "\\x118b48"]):
+        db.query(sql_query, params=[np.array(values, dtype=object)])
+    statements = [statement for statement, __ in conn.log]
+    prepare = statements[0]
+    assert prepare.startswith("PREPARE tools_")
+    assert prepare.endswith(
+        " (text[]) AS SELECT hll_cardinality(hll_union_agg(h)) "
+        "FROM unnest($1::hll[]) h")
+    name = prepare.split()[1]
+    assert statements[1:] == [f"EXECUTE {name} (%s)"] * 2
+    assert conn.log[2][1] == [["\\x118b48", "\\x118b48"]]
+
+
+def test_psycopg2_untyped_not_prepared():
+    conn = Psycopg2Connection()
+    db = tools.DbConn(conn)
+    db.query("SELECT %s", params=[None])
+    assert conn.log == [("SELECT %s", [None])]
+
+
+def test_query_cache_opt_in(database, tmp_path):
+    cache = tools.QueryCache(tmp_path / "queries")
+    db = tools.DbConn(database(), cache=cache)
+    sql_query = "SELECT count(*) AS n FROM numbers"
+    assert db.query(sql_query)["n"][0] == 5
+    with db.connection() as conn:
+        conn.execute("INSERT INTO numbers VALUES (5)")
+    # not cached without version, tables or cache=True
+    assert db.query(sql_query)["n"][0] == 6
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert db.query(sql_query, version="1")["n"][0] == 6
+    with db.connection() as conn:
+        conn.execute("INSERT INTO numbers VALUES (6)")
+    assert db.query(sql_query, version="1")["n"][0] == 6
+    assert db.query(sql_query, version="2")["n"][0] == 7
+    assert db.query(sql_query, cache=True)["n"][0] == 7
+    assert (cache.hits, cache.misses) == (1, 3)
@@ -0,0 +1,126 @@
+"""DownloadCache index and blobs (without network)"""
+
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from modules import tools
+
+
+def store_files(cache_dir: Path, worker: int, num_files: int) -> int:
+    cache = tools.DownloadCache(cache_dir)
+    for i in range(num_files):
+        file = cache.unique_tmp_path()
+        file.write_text(f"{worker}-{i}")
+        cache.store(f"https://example.org/{worker}/{i}", file)
+    return num_files
+
+
+def test_store_keeps_content(tmp_path):
+    cache = tools.DownloadCache(tmp_path / "cache")
+    file = tmp_path / "a.txt"
+    file.write_text("a")
+    blob = cache.store("https://example.org/a", file)
+    assert blob.read_text() == "a"
+    assert not file.exists()
+    assert cache.lookup("https://example.org/a") == blob
+
+
+@pytest.mark.skipif(
+    "fork" not in multiprocessing.get_all_start_methods(),
+    reason="requires fork")
+def test_store_concurrent_processes(tmp_path):
+    cache_dir = tmp_path / "cache"
+    workers, num_files = 4, 30
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("fork")) as executor:
+        stored = list(executor.map(
+            store_files, [cache_dir] * workers, range(workers),
+            [num_files] * workers))
+    assert sum(stored) == workers * num_files
+    cache = tools.DownloadCache(cache_dir)
+    index = cache._load_index()
+    blobs = [path for path in (cache_dir / "objects").rglob("*")
+             if path.is_file()]
+    assert len(index) == len(blobs) == workers * num_files
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Local http server for files in tmp_path / "www"
+    (answers conditional GETs with 304)"""
+    root = tmp_path / "www"
+    root.mkdir()
+    handler = partial(QuietHandler, directory=str(root))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield root, f"http://127.0.0.1:{httpd.server_port}/"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = tools.DownloadCache(tmp_path / "cache")
+    monkeypatch.setattr(tools, "_DOWNLOAD_CACHE", cache)
+    return cache
+
+
+def test_helpers_use_cache_by_default(server, cache, tmp_path):
+    root, url = server
+    (root / "zip").mkdir()
+    with zipfile.ZipFile(root / "zip" / "shapes.zip", "w") as z:
+        z.writestr("shapes/a.txt", "a" * 1000)
+    (root / "data.csv").write_text("x\n1\n")
+    output = tmp_path / "out"
+    tools.get_zip_extract(
+        output, uri_filename=f"{url}zip/shapes.zip", report=False)
+    assert (output / "shapes" / "a.txt").read_text() == "a" * 1000
+    blob = cache.lookup(f"{url}zip/shapes.zip")
+    assert blob is not None
+    # view maps the cached archive
+    view = tools.get_stream_view(f"{url}zip/shapes.zip", report=False)
+    assert view.tobytes() == blob.read_bytes()
+    view.release()
+    # file is a hard link to the cached file
+    target = tmp_path / "data.csv"
+    tools.get_stream_file(f"{url}data.csv", target)
+    assert target.read_text() == "x\n1\n"
+    assert os.path.samefile(target, cache.lookup(f"{url}data.csv"))
+    assert len(list((cache.cache_dir / "tmp").iterdir())) == 0
+
+
+def test_cache_switch(server, cache, tmp_path, monkeypatch):
+    root, url = server
+    (root / "data.csv").write_text("x\n1\n")
+    monkeypatch.setattr(tools, "USE_CACHE", False)
+    target = tmp_path / "data.csv"
+    tools.get_stream_file(f"{url}data.csv", target, parallel=False)
+    assert tools.get_stream_bytes(f"{url}data.csv", report=False) == (
+        b"x\n1\n")
+    assert target.read_text() == "x\n1\n"
+    assert cache.lookup(f"{url}data.csv") is None
+
+
+def test_modified_blob_is_not_used(server, cache, tmp_path):
+    root, url = server
+    (root / "data.csv").write_text("x\n1\n")
+    target = tmp_path / "data.csv"
+    tools.get_stream_file(f"{url}data.csv", target)
+    with open(target, "a") as f:
+        f.write("2\n")
+    assert cache.lookup(f"{url}data.csv") is None
@@ -0,0 +1,47 @@
+"""Folder helpers: tree and get_folder_size"""
+
+import zipfile
+from pathlib import Path
+
+from modules import tools
+
+
+def make_folder(folder: Path):
+    (folder / "sub").mkdir()
+    (folder / "b.txt").write_bytes(b"x" * 1024)
+    (folder / "a.csv").write_bytes(b"x" * 2048)
+    (folder / "sub" / "c.txt").write_bytes(b"x" * 4096)
+
+
+def test_tree_sort_key_receives_path(tmp_path):
+    make_folder(tmp_path)
+    keys = []
+    def sort_key(path):
+        keys.append(path)
+        return path.suffix, path.name
+    html = tools.tree(tmp_path, sort_key=sort_key).data
+    assert all(isinstance(key, Path) for key in keys)
+    assert html.index("a.csv") < html.index("b.txt")
+    assert "1 directories, 3 files" in html
+
+
+def test_get_folder_size_top_level_default(tmp_path):
+    make_folder(tmp_path)
+    entries = [tmp_path / "sub", tmp_path / "a.csv", tmp_path / "b.txt"]
+    top_level = sum(path.stat().st_size for path in entries) / (1024*1024)
+    assert tools.get_folder_size(tmp_path) == top_level
+    assert tools.get_folder_size(tmp_path, recursive=True) == (
+        7168 / (1024*1024))
+
+
+def test_zip_extract_reports_nested_size(tmp_path, capsys, monkeypatch):
+    monkeypatch.setattr(tools, "USE_CACHE", False)
+    archive = tmp_path / "archive.zip"
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("archive/nested/data.bin", b"x" * 300000)
+    output = tmp_path / "out"
+    monkeypatch.setattr(
+        tools, "get_stream_view",
+        lambda url, **kwargs: memoryview(archive.read_bytes()))
+    tools.get_zip_extract(output, uri_filename="https://example.org/a/b.zip")
+    assert "extracted size: 0.29 MB" in capsys.readouterr().out
@@ -0,0 +1,337 @@
+"""GBIF harvester (py/modules/gbif.py) against a local stub
+of the occurrence search API"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+import requests
+import shapely
+from shapely import wkt
+
+from modules import gbif
+
+
+class SearchStub:
+    """Occurrence search: paging (offset, limit, endOfRecords),
+    geometry and lastInterpreted filters, and queued error answers"""
+    def __init__(self, records=None):
+        self.records = records or []
+        # reported count, if other than the number of records
+        self.count = None
+        self.errors = []
+        self.queries = []
+        self._lock = threading.Lock()
+
+    def search(self, query):
+        records = self.records
+        if "geometry" in query:
+            points = shapely.points([
+                (record["decimalLongitude"], record["decimalLatitude"])
+                for record in records])
+            inside = shapely.intersects(wkt.loads(query["geometry"]), points)
+            records = [
+                record for record, keep in zip(records, inside) if keep]
+        if "lastInterpreted" in query:
+            since = query["lastInterpreted"].split(",")[0]
+            records = [
+                record for record in records
+                if (record.get("lastInterpreted") or "")[:10] >= since]
+        offset = int(query.get("offset", 0))
+        limit = int(query.get("limit", 20))
+        return {
+            "offset": offset, "limit": limit,
+            "count": len(records) if self.count is None else self.count,
+            "endOfRecords": offset + limit >= len(records),
+            "results": records[offset:offset + limit]}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    stub = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = {
+            key: values[0]
+            for key, values in parse_qs(urlparse(self.path).query).items()}
+        with self.stub._lock:
+            self.stub.queries.append(query)
+            status = self.stub.errors.pop(0) if self.stub.errors else None
+        if status is not None:
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            return
+        body = json.dumps(self.stub.search(query)).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub():
+    stub = SearchStub()
+    handler = type("Handler", (StubHandler,), {"stub": stub})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    stub.url = f"http://127.0.0.1:{httpd.server_port}/occurrence/search"
+    yield stub
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def occurrence(key: int, lon: float = 13.7, lat: float = 51.0,
+               last_interpreted: str = "2024-01-01T00:00:00.000+00:00"):
+    return {
+        "key": key, "decimalLongitude": lon, "decimalLatitude": lat,
+        "species": "Passer domesticus", "year": 2020,
+        "lastInterpreted": last_interpreted}
+
+
+REGION = shapely.box(13, 50, 14, 52)
+
+
+def test_harvest_paging(stub):
+    stub.records = [occurrence(key) for key in range(1000)]
+    df = gbif.harvest_occurrences(
+        {"taxon_key": 1}, url=stub.url, rate=0, report=False)
+    assert df["key"].tolist() == list(range(1000))
+    offsets = sorted(int(query["offset"]) for query in stub.queries)
+    assert offsets == [0, 300, 600, 900]
+    assert all(query["taxon_key"] == "1" for query in stub.queries)
+
+
+def test_harvest_stops_at_end_of_records(stub):
+    # count is an estimate: pages after endOfRecords are empty
+    stub.records = [occurrence(key) for key in range(700)]
+    stub.count = 3000
+    df = gbif.harvest_occurrences(
+        {}, url=stub.url, limit=100, max_workers=1, rate=0, report=False)
+    assert df["key"].tolist() == list(range(700))
+
+
+def test_harvest_max_records(stub):
+    stub.records = [occurrence(key) for key in range(1000)]
+    df = gbif.harvest_occurrences(
+        {}, url=stub.url, max_records=450, rate=0, report=False)
+    assert df["key"].tolist() == list(range(450))
+
+
+def test_harvest_retries(stub, monkeypatch):
+    delays = []
+    def retry_delay(attempt, retry_after=None, backoff=None):
+        delays.append((attempt, retry_after))
+        return 0
+    monkeypatch.setattr(gbif, "retry_delay", retry_delay)
+    stub.records = [occurrence(key) for key in range(500)]
+    stub.errors = [503, 503, 500]
+    df = gbif.harvest_occurrences(
+        {}, url=stub.url, max_workers=1, rate=0, report=False)
+    assert df["key"].tolist() == list(range(500))
+    assert len(stub.queries) == 2 + 3
+    # backoff grows with the attempt (no Retry-After)
+    assert delays == [(0, None), (1, None), (2, None)]
+
+
+def test_harvest_retries_429(stub, monkeypatch):
+    # 429 with Retry-After is first retried by the session adapter
+    # (urllib3, 3 retries), then by fetch_page
+    delays = []
+    def retry_delay(attempt, retry_after=None, backoff=None):
+        delays.append(attempt)
+        return 0
+    monkeypatch.setattr(gbif, "retry_delay", retry_delay)
+    stub.records = [occurrence(key) for key in range(10)]
+    stub.errors = [429] * 6
+    page = gbif.fetch_page({}, 0, url=stub.url, max_retries=2)
+    assert [record["key"] for record in page["results"]] == list(range(10))
+    assert len(stub.queries) == 7
+    assert delays == [0]
+
+
+def test_harvest_retries_exhausted(stub, monkeypatch):
+    monkeypatch.setattr(gbif, "retry_delay", lambda *args: 0)
+    stub.records = [occurrence(0)]
+    stub.errors = [503] * 3
+    with pytest.raises(requests.HTTPError):
+        gbif.fetch_page({}, 0, url=stub.url, max_retries=2)
+    assert len(stub.queries) == 3
+
+
+def test_retry_delay():
+    assert gbif.retry_delay(0, "2") == 2.0
+    for attempt in range(4):
+        delay = gbif.retry_delay(attempt, "Wed, 21 Oct 2015", backoff=1)
+        assert 2 ** attempt / 2 <= delay <= 2 ** attempt
+
+
+def test_rate_limiter():
+    limiter = gbif.RateLimiter(50)
+    start = time.monotonic()
+    for __ in range(6):
+        limiter.wait()
+    assert time.monotonic() - start >= 5 / 50
+
+
+def test_store_without_last_interpreted(stub, tmp_path):
+    stub.records = [
+        occurrence(key, last_interpreted=None) for key in range(5)]
+    store = gbif.OccurrenceStore(tmp_path / "store")
+    kwargs = dict(url=stub.url, rate=0, report=False)
+    assert store.refresh(1, "region", REGION, **kwargs) == 5
+    assert store.last_interpreted(1, "region") is None
+    stub.queries.clear()
+    assert store.refresh(1, "region", REGION, **kwargs) == 5
+    assert not any("lastInterpreted" in query for query in stub.queries)
+    assert len(store.load(1, "region")) == 5
+
+
+def test_store_invalid_state_full_harvest(stub, tmp_path):
+    stub.records = [occurrence(key) for key in range(5)]
+    store = gbif.OccurrenceStore(tmp_path / "store")
+    kwargs = dict(url=stub.url, rate=0, report=False)
+    store.refresh(1, "region", REGION, **kwargs)
+    assert store.last_interpreted(1, "region").startswith("2024-01-01")
+    state = json.loads(store.state_file.read_text())
+    state[store.partition(1, "region")]["last_interpreted"] = "NaT"
+    store.state_file.write_text(json.dumps(state))
+    assert store.last_interpreted(1, "region") is None
+    stub.queries.clear()
+    assert store.refresh(1, "region", REGION, **kwargs) == 5
+    assert not any("lastInterpreted" in query for query in stub.queries)
+
+
+@pytest.fixture
+def tiled_records(stub, monkeypatch):
+    """3200 occurrences in REGION: clustered, uniform, and on the
+    split lines of the first quadtree levels"""
+    monkeypatch.setattr(gbif, "OFFSET_LIMIT", 500)
+    rng = np.random.default_rng(1)
+    lons = np.concatenate([
+        rng.normal(13.74, 0.02, 800), rng.uniform(13, 14, 1800),
+        np.full(300, 13.5), rng.uniform(13, 14, 300)])
+    lats = np.concatenate([
+        rng.normal(51.05, 0.02, 800), rng.uniform(50, 52, 1800),
+        rng.uniform(50, 52, 300), np.full(300, 51.0)])
+    stub.records = [
+        occurrence(key, float(lon), float(lat))
+        for key, (lon, lat) in enumerate(zip(lons, lats))]
+    return stub
+
+
+def test_split_tiles(tiled_records):
+    tiles = gbif.split_tiles(
+        {}, REGION, url=tiled_records.url,
+        rate_limiter=gbif.RateLimiter(0))
+    assert max(tile.count for tile in tiles) < 500
+    assert max(tile.depth for tile in tiles) > 1
+    # points on tile edges are counted in each tile
+    assert sum(tile.count for tile in tiles) > 3200
+    for query in tiled_records.queries:
+        assert shapely.is_ccw(wkt.loads(query["geometry"]).exterior)
+
+
+def test_harvest_tiles_dedup(tiled_records, tmp_path):
+    df = gbif.harvest_tiles(
+        {"taxon_key": 1}, gbif.geometry_wkt(REGION),
+        url=tiled_records.url, rate=0, report=False)
+    assert len(df) == df["key"].nunique() == 3200
+    output = gbif.harvest_tiles(
+        {}, REGION, output=tmp_path / "tiles",
+        url=tiled_records.url, rate=0, report=False)
+    stored = gbif.read_occurrences(output)
+    assert sorted(stored["key"]) == list(range(3200))
+
+
+def test_quarter_geometry():
+    polygon = shapely.Polygon([(0, 0), (4, 0), (4, 1), (1, 1), (1, 4), (0, 4)])
+    quadrants = gbif.quarter_geometry(polygon)
+    assert len(quadrants) == 3
+    assert sum(part.area for part in quadrants) == pytest.approx(polygon.area)
+
+
+def test_store_delta_refresh(stub, tmp_path):
+    stub.records = [
+        occurrence(key, last_interpreted=f"2024-01-0{key + 1}T12:00:00Z")
+        for key in range(5)]
+    store = gbif.OccurrenceStore(tmp_path / "store")
+    kwargs = dict(url=stub.url, rate=0, report=False)
+    assert store.refresh(1, "region", REGION, **kwargs) == 5
+    assert store.last_interpreted(1, "region").startswith("2024-01-05")
+    # record 2 changed, record 10 added
+    stub.records[2] = {
+        **occurrence(2, last_interpreted="2024-02-01T00:00:00Z"),
+        "species": "Parus major"}
+    stub.records.append(
+        occurrence(10, last_interpreted="2024-02-01T00:00:00Z"))
+    stub.queries.clear()
+    # records of the last day (4) are retrieved again
+    assert store.refresh(1, "region", REGION, **kwargs) == 3
+    assert {query["lastInterpreted"] for query in stub.queries} == {
+        "2024-01-05,*"}
+    df = store.load(1, "region")
+    assert df["key"].tolist() == [0, 1, 2, 3, 4, 10]
+    assert df.set_index("key").loc[2, "species"] == "Parus major"
+    assert store.last_interpreted(1, "region").startswith("2024-02-01")
+    coordinates = store.load(columns=gbif.COORDINATE_COLUMNS)
+    assert list(coordinates.columns) == gbif.COORDINATE_COLUMNS
+    assert len(coordinates) == 6
+    # full refresh rebuilds the partition
+    stub.records = stub.records[:2]
+    assert store.refresh(1, "region", REGION, full=True, **kwargs) == 2
+    assert store.load(1, "region")["key"].tolist() == [0, 1]
+
+
+def test_occurrence_frame_dtypes():
+    records = [
+        {**occurrence(1), "eventDate": "2020-05-03T10:00:00",
+         "individualCount": 3, "month": 5, "media": [{"type": "StillImage"}]},
+        {**occurrence(2), "eventDate": "2020-05/2020-06", "taxonKey": 9},
+        {"key": 3},
+    ]
+    df = gbif.occurrence_frame(records)
+    assert list(df.columns) == list(gbif.OCCURRENCE_SCHEMA)
+    assert {col: str(dtype) for col, dtype in df.dtypes.items()} == (
+        gbif.OCCURRENCE_SCHEMA)
+    assert df["individualCount"].isna().tolist() == [False, True, True]
+    assert df["taxonKey"].tolist()[1] == 9
+    # date ranges are not a point in time
+    assert df["eventDate"].isna().tolist() == [False, True, True]
+    assert df["species"].cat.categories.tolist() == ["Passer domesticus"]
+
+
+def test_concat_frames_keeps_categories():
+    first = gbif.occurrence_frame([occurrence(1)])
+    second = gbif.occurrence_frame(
+        [{**occurrence(2), "species": "Parus major"}])
+    df = gbif.concat_frames([first, second])
+    assert df["species"].dtype == "category"
+    assert sorted(df["species"].cat.categories) == [
+        "Parus major", "Passer domesticus"]
+
+
+def test_harvest_dtypes(stub, tmp_path):
+    # stateProvince only on the first page
+    stub.records = [
+        {**occurrence(key), "stateProvince": "Sachsen"} if key < 300
+        else occurrence(key) for key in range(400)]
+    df = gbif.harvest_occurrences({}, url=stub.url, rate=0, report=False)
+    assert dict(df.dtypes.astype(str)) == gbif.OCCURRENCE_SCHEMA
+    raw = gbif.harvest_occurrences(
+        {}, url=stub.url, rate=0, report=False, raw=True)
+    assert raw["lastInterpreted"].dtype != "datetime64[ms, UTC]"
+    output = gbif.harvest_occurrences(
+        {}, output=tmp_path / "pages", url=stub.url, rate=0, report=False)
+    stored = gbif.read_occurrences(output)
+    assert dict(stored.dtypes.astype(str)) == gbif.OCCURRENCE_SCHEMA
+    assert stored["stateProvince"].notna().sum() == 300
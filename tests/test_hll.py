@@ -0,0 +1,154 @@
+"""Local hll engine (py/modules/hll.py) against postgresql-hll
+
+hll_cardinality.csv.gz and hll_union.csv.gz are excerpts of the
+regression data of postgresql-hll (sql/data/*.csv, Apache License 2.0),
+with the cardinality and hll_union_agg results of the extension for
+EMPTY, EXPLICIT, SPARSE and FULL sets, including the promotion of
+EXPLICIT sets to registers. Cardinalities are the unrounded
+hll_cardinality values.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import DATA_DIR
+from modules import hll, tools
+
+# version 1, log2m=11, regwidth=5, expthresh=128, sparseon=1
+UNDEFINED = "\\x108b48"
+EMPTY = "\\x118b48"
+# same, but expthresh=-1 (auto)
+EMPTY_AUTO = "\\x118b7f"
+# log2m=10
+EMPTY_LOG2M_10 = "\\x118a48"
+
+
+@pytest.fixture(scope="module")
+def cardinality_data() -> pd.DataFrame:
+    return pd.read_csv(DATA_DIR / "hll_cardinality.csv.gz")
+
+
+@pytest.fixture(scope="module")
+def union_data() -> pd.DataFrame:
+    return pd.read_csv(DATA_DIR / "hll_union.csv.gz")
+
+
+def cumulative_groups(df: pd.DataFrame) -> pd.Series:
+    """hll sets of the fixture as groups: group i holds rows 0..i"""
+    rows = [
+        (row, multiset)
+        for row in range(len(df))
+        for multiset in df["multiset"].values[:row + 1]]
+    index, values = zip(*rows)
+    return pd.Series(values, index=pd.Index(index, name="group"), name="hll")
+
+
+def test_fixture_representations(cardinality_data, union_data):
+    hll_types = set(cardinality_data["multiset"].str[3].astype(int))
+    assert hll_types == {
+        hll.HLL_EMPTY, hll.HLL_EXPLICIT, hll.HLL_SPARSE, hll.HLL_FULL}
+    union_types = set(union_data["union_multiset"].str[3].astype(int))
+    assert union_types == hll_types
+
+
+def test_cardinality(cardinality_data):
+    cardinalities = hll.cardinality(
+        hll.decode(cardinality_data["multiset"].tolist()))
+    np.testing.assert_allclose(
+        cardinalities, cardinality_data["cardinality"], rtol=1e-9)
+
+
+def test_hll_series_cardinality(cardinality_data):
+    series = pd.Series(cardinality_data["multiset"].values, name="user_hll")
+    result = tools.hll_series_cardinality(series)
+    assert result.dtype == "Int64"
+    assert result.name == "user_hll"
+    expected = np.rint(cardinality_data["cardinality"]).astype(np.int64)
+    assert (result.to_numpy() == expected.to_numpy()).all()
+
+
+@pytest.mark.parametrize("source", [
+    "cumulative_union_comprehensive", "cumulative_union_explicit_promotion"])
+def test_union_agg(union_data, source):
+    df = union_data[union_data["source"] == source].reset_index(drop=True)
+    hll_series = cumulative_groups(df)
+    cardinalities = tools.union_hll_series_local(hll_series)
+    assert cardinalities.dtype == "Int64"
+    assert (cardinalities.to_numpy()
+            == np.rint(df["union_cardinality"]).to_numpy()).all()
+    union = tools.union_hll_series_local(hll_series, cardinality=False)
+    expected = hll.decode(df["union_multiset"].tolist())
+    result = hll.decode(union.tolist())
+    np.testing.assert_array_equal(result.kinds, expected.kinds)
+    np.testing.assert_array_equal(
+        result.explicit_offsets, expected.explicit_offsets)
+    np.testing.assert_array_equal(
+        result.explicit_values, expected.explicit_values)
+    np.testing.assert_array_equal(result.registers, expected.registers)
+
+
+def test_undefined_cardinality_is_na():
+    series = pd.Series([EMPTY, UNDEFINED], index=["a", "b"])
+    result = tools.hll_series_cardinality(series)
+    assert result.dtype == "Int64"
+    assert result["a"] == 0
+    assert result["b"] is pd.NA
+
+
+def test_union_with_undefined_is_na(cardinality_data):
+    multiset = cardinality_data["multiset"].iloc[3]
+    series = pd.Series(
+        [multiset, UNDEFINED, multiset, EMPTY], index=[1, 1, 2, 2])
+    result = tools.union_hll_series(series)
+    assert result.dtype == "Int64"
+    assert result[1] is pd.NA
+    assert result[2] > 0
+
+
+@pytest.mark.parametrize("other", [EMPTY_AUTO, EMPTY_LOG2M_10])
+def test_union_parameter_mismatch_raises(other):
+    series = pd.Series([EMPTY, other], index=[1, 1])
+    with pytest.raises(ValueError, match="does not match|do not match"):
+        tools.union_hll_series(series)
+
+
+@pytest.mark.parametrize("hll_series", [
+    lambda: iter([]),
+    lambda: pd.Series([], index=pd.Index([], name="bin"), dtype=str),
+    lambda: iter([pd.Series(
+        [], index=pd.MultiIndex.from_arrays([[], []], names=["x", "y"]),
+        dtype=str)]),
+])
+def test_union_chunked_empty(hll_series):
+    result = tools.union_hll_series_chunked(hll_series())
+    assert result.empty
+    assert result.dtype == "Int64"
+    assert result.name == "hll_cardinality"
+    union = tools.union_hll_series_chunked(hll_series(), cardinality=False)
+    assert union.empty
+    assert union.name == "hll_union"
+
+
+def test_union_chunked(union_data):
+    df = union_data[
+        union_data["source"] == "cumulative_union_comprehensive"]
+    hll_series = cumulative_groups(df.reset_index(drop=True))
+    chunks = (hll_series.iloc[i:i + 100] for i in range(0, len(hll_series), 100))
+    result = tools.union_hll_series_chunked(chunks, batch_size=50)
+    expected = tools.union_hll_series_local(hll_series)
+    pd.testing.assert_series_equal(
+        result, expected.rename("hll_cardinality"), check_index_type=False)
+
+
+def test_record_preview_coordinates(tmp_path, monkeypatch):
+    file = tmp_path / "hll.csv"
+    file.write_text(
+        "latitude,longitude,user_hll,post_hll\n"
+        f"51.1,13.7,{EMPTY},{EMPTY}\n")
+    shown = []
+    monkeypatch.setattr(tools, "display", shown.append)
+    tools.record_preview_hll(file)
+    record = shown[0].data
+    assert record.loc["latitude", 0] == 51.1
+    assert record.loc["longitude", 0] == 13.7